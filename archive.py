@@ -0,0 +1,196 @@
+import argparse
+import sqlite3
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Iterable
+
+from concert import Concert
+
+
+# Arkiv over alle koncerter der nogensinde har været på siden.
+# concerts.json overskrives ved hver kørsel, men arkivet gemmer hver
+# koncert en gang og ændringer i pris og udsolgt som rækker i "changes",
+# så fx "hvornår blev X udsolgt" kan slås op uden at gå git-historikken igennem.
+# Intet slettes fra arkivet.
+#
+#   python archive.py concerts --from 2026-01-01 --to 2026-02-01 --venue Posten
+#   python archive.py changes --field sold_out --venue Dexter
+#   python archive.py history https://dexter.dk/event/...
+
+
+ARCHIVE_PATH = Path("archive.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS concerts (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    date TEXT NOT NULL,
+    title TEXT NOT NULL,
+    venue TEXT NOT NULL,
+    price REAL,
+    sold_out INTEGER NOT NULL,
+    img_url TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    -- Enkelte events har samme URL på flere datoer
+    UNIQUE (url, date)
+);
+CREATE INDEX IF NOT EXISTS concerts_date ON concerts (date);
+CREATE INDEX IF NOT EXISTS concerts_venue_date ON concerts (venue, date);
+
+CREATE TABLE IF NOT EXISTS changes (
+    concert_id INTEGER NOT NULL REFERENCES concerts (id),
+    seen_at TEXT NOT NULL,
+    field TEXT NOT NULL,  -- "price" eller "sold_out"
+    old,
+    new
+);
+CREATE INDEX IF NOT EXISTS changes_concert ON changes (concert_id, seen_at);
+CREATE INDEX IF NOT EXISTS changes_seen_at ON changes (seen_at);
+"""
+
+# Felter hvor ændringer gemmes
+TRACKED = ("price", "sold_out")
+# Felter der overskrives med den nyeste værdi
+UPDATED = ("title", "venue", "price", "sold_out", "img_url")
+# Hvor ofte last_seen opdateres. Arkivet ligger i git, så det skal kun
+# ændres når en koncert faktisk er ændret, ikke ved hver kørsel.
+SEEN_RESOLUTION_DAYS = 7
+
+
+def open_archive(path: Path = ARCHIVE_PATH) -> sqlite3.Connection:
+    """Åbn (eller opret) arkivet."""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record(conn: sqlite3.Connection, concerts: Iterable[Concert],
+           seen_at: datetime | None = None) -> tuple[int, int]:
+    """Gem en kørsels koncerter. Returner (antal nye, antal ændrede).
+
+    Kun koncerter der lige er hentet skal gemmes, ikke gamle fra sidste
+    gang en scraper virkede.
+    """
+    seen_at = seen_at or datetime.now()
+    seen = seen_at.isoformat(timespec="seconds")
+    last_week = (seen_at - timedelta(days=SEEN_RESOLUTION_DAYS)).isoformat(timespec="seconds")
+    added = changed = 0
+    with conn:
+        for c in concerts:
+            row = conn.execute(
+                "SELECT id, title, venue, price, sold_out, img_url, last_seen"
+                " FROM concerts WHERE url = ? AND date = ?",
+                (c.url, c.date.isoformat())).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO concerts (url, date, title, venue, price, sold_out,"
+                    " img_url, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (c.url, c.date.isoformat(), c.title, c.venue, c.price,
+                     c.sold_out, c.img_url, seen, seen))
+                added += 1
+                continue
+            deltas = [(row["id"], seen, field, row[field], new)
+                      for (field, new) in zip(TRACKED, (c.price, c.sold_out))
+                      if row[field] != new]
+            if deltas:
+                conn.executemany(
+                    "INSERT INTO changes (concert_id, seen_at, field, old, new)"
+                    " VALUES (?, ?, ?, ?, ?)", deltas)
+                changed += 1
+            # Rør ikke rækken hvis intet er ændret og den er set for nylig
+            values = (c.title, c.venue, c.price, c.sold_out, c.img_url)
+            if (all(row[field] == new for (field, new) in zip(UPDATED, values))
+                    and row["last_seen"] > last_week):
+                continue
+            conn.execute(
+                "UPDATE concerts SET title = ?, venue = ?, price = ?, sold_out = ?,"
+                " img_url = ?, last_seen = ? WHERE id = ?",
+                (*values, seen, row["id"]))
+    return (added, changed)
+
+
+def concerts(conn: sqlite3.Connection, start: date | None = None,
+             end: date | None = None, venue: str | None = None) -> list[sqlite3.Row]:
+    """Koncerter fra og med start til (men ikke med) end, evt. kun ved venue."""
+    where = []
+    params = []
+    if venue is not None:
+        where.append("venue = ?")
+        params.append(venue)
+    if start is not None:
+        where.append("date >= ?")
+        params.append(start.isoformat())
+    if end is not None:
+        where.append("date < ?")
+        params.append(end.isoformat())
+    sql = "SELECT * FROM concerts"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return conn.execute(sql + " ORDER BY date, venue, title", params).fetchall()
+
+
+def history(conn: sqlite3.Connection, url: str) -> list[sqlite3.Row]:
+    """Alle ændringer for koncerterne med URL'en, ældste først."""
+    return conn.execute(
+        "SELECT concerts.date, concerts.title, changes.* FROM concerts"
+        " JOIN changes ON changes.concert_id = concerts.id"
+        " WHERE concerts.url = ? ORDER BY changes.seen_at", (url,)).fetchall()
+
+
+def changes(conn: sqlite3.Connection, field: str | None = None,
+            venue: str | None = None, since: date | None = None) -> list[sqlite3.Row]:
+    """Ændringer (fx field="sold_out"), evt. kun ved venue og siden since."""
+    where = []
+    params = []
+    if field is not None:
+        where.append("changes.field = ?")
+        params.append(field)
+    if venue is not None:
+        where.append("concerts.venue = ?")
+        params.append(venue)
+    if since is not None:
+        where.append("changes.seen_at >= ?")
+        params.append(since.isoformat())
+    sql = ("SELECT concerts.url, concerts.date, concerts.title, concerts.venue,"
+           " changes.seen_at, changes.field, changes.old, changes.new"
+           " FROM changes JOIN concerts ON changes.concert_id = concerts.id")
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return conn.execute(sql + " ORDER BY changes.seen_at", params).fetchall()
+
+
+def print_rows(rows: list[sqlite3.Row]):
+    for row in rows:
+        print("  ".join(str(row[key]) for key in row.keys()))
+    print(f"({len(rows)} rækker)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slå op i arkivet over koncerter.")
+    parser.add_argument("--archive", type=Path, default=ARCHIVE_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    concerts_parser = sub.add_parser("concerts", help="koncerter i en periode")
+    concerts_parser.add_argument("--from", dest="start", type=date.fromisoformat)
+    concerts_parser.add_argument("--to", dest="end", type=date.fromisoformat)
+    concerts_parser.add_argument("--venue")
+    history_parser = sub.add_parser("history", help="ændringer for en koncert")
+    history_parser.add_argument("url")
+    changes_parser = sub.add_parser("changes", help="ændringer i pris og udsolgt")
+    changes_parser.add_argument("--field", choices=TRACKED)
+    changes_parser.add_argument("--venue")
+    changes_parser.add_argument("--since", type=date.fromisoformat)
+    args = parser.parse_args()
+
+    conn = open_archive(args.archive)
+    if args.command == "concerts":
+        print_rows(concerts(conn, args.start, args.end, args.venue))
+    elif args.command == "history":
+        print_rows(history(conn, args.url))
+    elif args.command == "changes":
+        print_rows(changes(conn, args.field, args.venue, args.since))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+import argparse
+import functools
+import http.server
+import importlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+import fetch
+import metrics
+import scrapers
+import thumbnails
+from concert import (Concert, dump_concerts, dump_concerts_compact,
+                     iter_concerts, load_concerts, load_concerts_compact,
+                     load_table_compact)
+
+
+# Benchmarks der kører på optagede svar fra spillestederne (ingen netværk).
+# Svarene er fetch's cache, optaget i FIXTURES_DIR med "record", og
+# afspilles med fetch.OFFLINE. Se README.md i FIXTURES_DIR for hvor de
+# nuværende svar kommer fra. Miniaturerne laves af faste billeder der
+# serveres fra en lokal server.
+#
+#   python bench.py record      optag svar fra spillestederne (netværk)
+#   python bench.py suite       alle scrapere, all_concerts, miniaturer og siden
+#   python bench.py parse       parsere per spillested
+#   python bench.py serialize   indlæsning/skrivning af koncerter
+#
+# Resultaterne fra "suite" lægges til RESULTS_PATH (en linje JSON per
+# måling) så de kan sammenlignes over tid.
+
+
+FIXTURES_DIR = Path("fixtures/http")
+RESULTS_PATH = Path("bench-results.jsonl")
+# Antal billeder i billedsættet til miniaturerne
+IMAGE_CORPUS = 12
+
+
+def use_fixtures():
+    """Hent kun fra de optagede svar."""
+    if not any(FIXTURES_DIR.glob("*.body")):
+        raise FileNotFoundError(f"Ingen fixtures i {FIXTURES_DIR} (kør record)")
+    fetch.CACHE_DIR = FIXTURES_DIR
+    fetch.OFFLINE = True
+
+
+@contextmanager
+def temporary_last_good():
+    """Lad all_concerts gemme koncerterne fra sidste gang i en midlertidig
+    mappe, så den rigtige kørsels .cache/last-good.json ikke røres."""
+    last_good_path = scrapers.LAST_GOOD_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        scrapers.LAST_GOOD_PATH = Path(tmp) / "last-good.json"
+        try:
+            yield
+        finally:
+            scrapers.LAST_GOOD_PATH = last_good_path
+
+
+def record_fixtures():
+    """Hent alle spillestederne og gem svarene som fixtures.
+
+    De gamle fixtures slettes først (fx detaljesider for koncerter der er
+    forbi), og hvis en scraper fejler, fejler det hele.
+    """
+    shutil.rmtree(FIXTURES_DIR, ignore_errors=True)
+    fetch.CACHE_DIR = FIXTURES_DIR
+    fetch.OFFLINE = False
+    scrapers.parse_cache = NoParseCache()
+    with temporary_last_good():
+        concerts = scrapers.all_concerts(strict=True)
+    print(f"Optaget {len(concerts)} koncerter i {FIXTURES_DIR}")
+
+
+# Spillesteder med flere parsere (scrapers.PdSpec)
+PARSE_VENUES = ("Posten", "Dexter")
+PARSERS = ("bs4", "lxml", "stream")
+
+
+class NoParseCache:
+    """Parse altid, så det kun er parseren der måles."""
+
+    def parse(self, venue, raw, parse):
+        return parse()
+
+
+def max_rss_kib() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_parse(venue: str, parser: str, repeat: int) -> dict:
+    """Mål tid og hukommelse for at parse et spillesteds sider.
+
+    Køres i sin egen proces så den højeste hukommelse kan måles.
+    """
+    use_fixtures()
+    scrapers.parse_cache = NoParseCache()
+    spec = scrapers.SCRAPERS[venue]
+    pages = scrapers.pd_fetch_pages(spec.domain)
+    rss_before = max_rss_kib()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        concerts = scrapers.pd_parse(pages, venue, spec.date_no, spec.price_no,
+                                     parser=parser)
+        times.append(time.perf_counter() - start)
+    return {
+        "venue": venue,
+        "parser": parser,
+        "events": len(concerts),
+        "best_s": min(times),
+        "mean_s": sum(times) / len(times),
+        "peak_kib": max_rss_kib() - rss_before,
+    }
+
+
+def run_isolated(fn, *args):
+    """Kør fn i en ny proces og returner resultatet."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def parse_benchmarks(repeat: int) -> list[dict]:
+    results = []
+    for venue in PARSE_VENUES:
+        for parser in PARSERS:
+            results.append(run_isolated(bench_parse, venue, parser, repeat))
+    return results
+
+
+def print_parse_results(results: list[dict]):
+    print(f"{'Spillested':<12} {'Parser':<8} {'Events':>6} "
+          f"{'Bedste (ms)':>12} {'Snit (ms)':>10} {'Hukommelse (KiB)':>17}")
+    for r in results:
+        print(f"{r['venue']:<12} {r['parser']:<8} {r['events']:>6} "
+              f"{r['best_s'] * 1000:>12.1f} {r['mean_s'] * 1000:>10.1f} "
+              f"{r['peak_kib']:>17}")
+
+
+def synthetic_concerts(count: int) -> list[Concert]:
+    """Et arkiv-stort datasæt: concerts.json gentaget med forskudte datoer."""
+    with open("concerts.json", "r") as file:
+        base = load_concerts(file)
+    concerts = []
+    for i in range(count):
+        c = base[i % len(base)]
+        shift = timedelta(weeks=i // len(base))
+        concerts.append(Concert(c.title, c.venue, c.date + shift, c.price,
+                                c.sold_out, c.img_url, f"{c.url}#{i}",
+                                list(c.tags)))
+    return concerts
+
+
+# Den oprindelige måde at gemme og indlæse på, til sammenligning.
+def legacy_dump(concerts: list[Concert], file):
+    json.dump([asdict(c) | {"date": c.date.isoformat()} for c in concerts], file)
+
+
+def legacy_load(file) -> list[Concert]:
+    return [Concert(**(c | {"date": datetime.fromisoformat(c["date"])}))
+            for c in json.load(file)]
+
+
+def stream_count(file) -> int:
+    """Gennemløb koncerterne uden at gemme dem."""
+    return sum(1 for _ in iter_concerts(file))
+
+
+# Navn -> (skriv, læs, binær fil)
+SERIALIZERS = {
+    "json (gammel)": (legacy_dump, legacy_load, False),
+    "json": (dump_concerts, load_concerts, False),
+    "json (stream)": (dump_concerts, stream_count, False),
+    "kompakt": (dump_concerts_compact, load_concerts_compact, True),
+    "kompakt tabel": (dump_concerts_compact, load_table_compact, True),
+}
+
+
+def measure(fn, *args) -> tuple[float, int]:
+    """Kør fn og returner (sekunder, højeste hukommelse i bytes)."""
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(*args)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (elapsed, peak)
+
+
+def serialize_benchmarks(count: int) -> list[dict]:
+    concerts = synthetic_concerts(count)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (dump, load, binary) in SERIALIZERS.items():
+            path = os.path.join(tmp, "concerts")
+            mode = "b" if binary else ""
+
+            def do_dump():
+                with open(path, "w" + mode) as file:
+                    dump(concerts, file)
+
+            def do_load():
+                with open(path, "r" + mode) as file:
+                    load(file)
+
+            (dump_s, dump_peak) = measure(do_dump)
+            (load_s, load_peak) = measure(do_load)
+            results.append({
+                "format": name,
+                "count": count,
+                "size_bytes": os.path.getsize(path),
+                "dump_s": dump_s,
+                "load_s": load_s,
+                "dump_peak_bytes": dump_peak,
+                "load_peak_bytes": load_peak,
+            })
+    return results
+
+
+def print_serialize_results(results: list[dict]):
+    print(f"{'Format':<14} {'Antal':>7} {'Størrelse (MiB)':>16} "
+          f"{'Skriv (s)':>10} {'Læs (s)':>8} "
+          f"{'Hukommelse skriv/læs (MiB)':>27}")
+    for r in results:
+        memory = (f"{r['dump_peak_bytes'] / 2**20:.1f}/"
+                  f"{r['load_peak_bytes'] / 2**20:.1f}")
+        print(f"{r['format']:<14} {r['count']:>7} "
+              f"{r['size_bytes'] / 2**20:>16.1f} {r['dump_s']:>10.2f} "
+              f"{r['load_s']:>8.2f} {memory:>27}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def timed(fn, repeat: int, setup=None) -> tuple[list[float], object]:
+    """Kør fn repeat gange og returner tiderne og det sidste resultat."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return (times, result)
+
+
+def result(suite: str, name: str, times: list[float], **extra) -> dict:
+    return {
+        "suite": suite,
+        "name": name,
+        "best_s": min(times),
+        "mean_s": sum(times) / len(times),
+        "repeat": len(times),
+    } | extra
+
+
+def bench_scrapers(repeat: int) -> list[dict]:
+    """Hver scraper for sig: indlæsning af de optagede svar og parsning."""
+    results = []
+    for name, scraper in scrapers.SCRAPERS.items():
+        try:
+            (times, concerts) = timed(scraper, repeat)
+        except fetch.OfflineError as e:
+            e.add_note(f"{name} mangler fixtures (kør record)")
+            raise
+        results.append(result("scrapers", name, times, events=len(concerts)))
+    return results
+
+
+def bench_all_concerts(repeat: int) -> list[dict]:
+    """Alle scraperne samtidig. Fejler hvis en scraper fejler (strict)."""
+    with temporary_last_good():
+        (times, concerts) = timed(lambda: scrapers.all_concerts(strict=True),
+                                  repeat, setup=metrics.reset)
+    return [result("all_concerts", "all_concerts", times, events=len(concerts))]
+
+
+def make_image_corpus(directory: Path, count: int) -> list[str]:
+    """Lav count faste JPEG-billeder i mappen. Returner filnavnene."""
+    rng = random.Random(0)
+    names = []
+    for i in range(count):
+        (width, height) = rng.choice([(1600, 900), (1200, 1200), (1024, 683)])
+        img = Image.new("RGB", (width, height), tuple(rng.choices(range(256), k=3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(40):
+            (x0, x1) = sorted(rng.sample(range(width), 2))
+            (y0, y1) = sorted(rng.sample(range(height), 2))
+            draw.ellipse((x0, y0, x1, y1), fill=tuple(rng.choices(range(256), k=3)))
+        name = f"{i:03}.jpg"
+        img.save(directory / name, quality=90)
+        names.append(name)
+    return names
+
+
+@contextmanager
+def serve(directory: Path):
+    """Server mappen over HTTP lokalt. Giver URL'en til mappen."""
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    handler = functools.partial(Handler, directory=str(directory))
+    with http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{server.server_address[1]}/"
+        finally:
+            server.shutdown()
+
+
+def bench_thumbnails(repeat: int) -> list[dict]:
+    """Miniaturer til et fast billedsæt, hver gang fra en tom mappe."""
+    concerts = synthetic_concerts(IMAGE_CORPUS)
+    saved = (thumbnails.IMAGES_DIR, thumbnails.MANIFEST_PATH, fetch.OFFLINE)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        corpus = tmp / "corpus"
+        corpus.mkdir()
+        names = make_image_corpus(corpus, IMAGE_CORPUS)
+        images = tmp / "images"
+        thumbnails.IMAGES_DIR = images
+        thumbnails.MANIFEST_PATH = images / "manifest.json"
+        fetch.OFFLINE = False
+        try:
+            with serve(corpus) as url:
+                def setup():
+                    shutil.rmtree(images, ignore_errors=True)
+                    images.mkdir()
+                    for concert, name in zip(concerts, names):
+                        concert.img_url = url + name
+
+                (times, _) = timed(lambda: thumbnails.make_thumbnails(concerts),
+                                   repeat, setup=setup)
+            size = sum(f.stat().st_size for f in images.iterdir())
+        finally:
+            (thumbnails.IMAGES_DIR, thumbnails.MANIFEST_PATH, fetch.OFFLINE) = saved
+    return [result("thumbnails", "make_thumbnails", times,
+                   images=IMAGE_CORPUS, output_bytes=size)]
+
+
+def bench_html(repeat: int) -> list[dict]:
+    """Siden fra bunden (uden render-state) med koncerterne i concerts.json."""
+    # Filnavnet har bindestreg, så det importeres ved navn
+    main_module = importlib.import_module("odense-koncerter")
+    with open("concerts.json", "r") as file:
+        concerts = load_concerts(file)
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = Path(tmp) / "index.html"
+
+        def setup():
+            (Path(tmp) / main_module.RENDER_STATE).unlink(missing_ok=True)
+
+        (times, _) = timed(lambda: main_module.make_html(out_path, concerts),
+                           repeat, setup=setup)
+    return [result("html", "make_html", times, events=len(concerts))]
+
+
+SUITES = {
+    "scrapers": bench_scrapers,
+    "all_concerts": bench_all_concerts,
+    "thumbnails": bench_thumbnails,
+    "html": bench_html,
+}
+
+
+def run_suites(names: list[str], repeat: int) -> list[dict]:
+    use_fixtures()
+    scrapers.parse_cache = NoParseCache()
+    run = {"run_at": datetime.now().isoformat(timespec="seconds"),
+           "commit": git_commit()}
+    results = []
+    for name in names:
+        results.extend(run | r for r in SUITES[name](repeat))
+        use_fixtures()
+    return results
+
+
+def save_results(results: list[dict], path: Path = RESULTS_PATH):
+    with open(path, "a") as file:
+        for r in results:
+            file.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+def print_suite_results(results: list[dict]):
+    print(f"{'Suite':<14} {'Navn':<16} {'Bedste (ms)':>12} {'Snit (ms)':>10}")
+    for r in results:
+        print(f"{r['suite']:<14} {r['name']:<16} {r['best_s'] * 1000:>12.1f} "
+              f"{r['mean_s'] * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for scraperne.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    parse = sub.add_parser("parse", help="sammenlign parsere per spillested")
+    parse.add_argument("--repeat", type=int, default=10)
+    serialize = sub.add_parser("serialize", help="sammenlign formater til koncerter")
+    serialize.add_argument("--count", type=int, default=100_000)
+    sub.add_parser("record", help="optag svar fra spillestederne")
+    suite = sub.add_parser("suite", help="scrapere, all_concerts, miniaturer og siden")
+    suite.add_argument("--repeat", type=int, default=5)
+    suite.add_argument("--only", action="append", choices=SUITES,
+                       help="kør kun denne suite (kan gentages)")
+    suite.add_argument("--results", type=Path, default=RESULTS_PATH)
+    args = parser.parse_args()
+    if args.command == "record":
+        record_fixtures()
+    elif args.command == "suite":
+        results = run_suites(args.only or list(SUITES), args.repeat)
+        print_suite_results(results)
+        save_results(results, args.results)
+    elif args.command == "parse":
+        print_parse_results(parse_benchmarks(args.repeat))
+    elif args.command == "serialize":
+        print_serialize_results(serialize_benchmarks(args.count))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,315 @@
+import array
 import json
-from dataclasses import dataclass, asdict
-from datetime import datetime
-from io import TextIOBase
-from typing import Any
+import math
+import re
+import struct
+import sys
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import lru_cache
+from io import BufferedIOBase, TextIOBase
+from typing import Any, Callable, Iterable, Iterator
 
 
-@dataclass
+# slots=True: ingen __dict__ per koncert, hvilket betyder meget for store arkiver.
+@dataclass(slots=True)
 class Concert:
     title: str
-    venue: str  # Måske en enum
+    venue: str  # Interneret (sys.intern), se __post_init__
     date: datetime
     price: int
     sold_out: bool
     img_url: str
     url: str
+    # Kategorier fra tagging.py (fx "quiz") og fra scraperen
+    tags: list[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        # Der er kun en håndfuld spillesteder og tags, så alle koncerter
+        # deler de samme strenge i stedet for at have hver deres kopi.
+        # str() fordi sys.intern ikke tager underklasser (fx NavigableString).
+        self.venue = sys.intern(str(self.venue))
+        self.tags = [sys.intern(str(tag)) for tag in self.tags]
+
+    @property
+    def key(self) -> tuple[str, datetime, str]:
+        """Hvad der gør koncerten unik (bruges fx af dedup.py)."""
+        return (self.venue, self.date, self.title)
+
+    # Hash kun nøglen. Ens koncerter har også ens nøgle, så det passer med
+    # __eq__. Felterne i nøglen ændres ikke efter koncerten er lavet.
+    def __hash__(self) -> int:
+        return hash(self.key)
 
     @classmethod
     def from_json(cls, json: dict[str, Any]) -> "Concert":
         # Behold alt men parse datoen til en datetime
-        concert = json | {"date": datetime.fromisoformat(json["date"])}
-        return cls(**concert)
+        return cls(json["title"], json["venue"], parse_date(json["date"]),
+                   json["price"], json["sold_out"], json["img_url"],
+                   json["url"], json.get("tags", []))
 
     def as_json(self) -> dict[str, Any]:
         # JSONen kan ikke indeholde en datetime så erstat med streng
-        return asdict(self) | {"date": self.date.isoformat()}
+        return {
+            "title": self.title,
+            "venue": self.venue,
+            "date": self.date.isoformat(),
+            "price": self.price,
+            "sold_out": self.sold_out,
+            "img_url": self.img_url,
+            "url": self.url,
+            "tags": list(self.tags),
+        }
+
+
+# Mange koncerter har samme dato, så de parses kun en gang
+@lru_cache(maxsize=4096)
+def parse_date(s: str) -> datetime:
+    return datetime.fromisoformat(s)
+
+
+re_whitespace = re.compile(r"\s*")
+
+
+def iter_concerts(file: TextIOBase, chunk_size: int = 1 << 16) -> Iterator[Concert]:
+    """Læs koncerter fra JSON fil en ad gangen.
+
+    Hele filen er aldrig i hukommelsen på én gang, kun chunk_size tegn.
+    Fejl i filen (også en tom fil) giver json.JSONDecodeError.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def next_char() -> str:
+        """Spring whitespace over (også over flere chunks) og returner det
+        næste tegn, eller "" ved slutningen af filen."""
+        nonlocal pos
+        while True:
+            pos = re_whitespace.match(buffer, pos).end()
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos+1]
+            read_more()
+
+    if next_char() != "[":
+        raise json.JSONDecodeError("Forventede en JSON-liste af koncerter", buffer, pos)
+    pos += 1
+    if next_char() == "]":
+        return
+    while True:
+        next_char()
+        try:
+            (concert_json, end) = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Koncerten er ikke læst helt endnu
+            if eof:
+                raise
+            read_more()
+            continue
+        yield Concert.from_json(concert_json)
+        pos = end
+        # Præcis ét komma mellem koncerterne
+        separator = next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("Forventede ',' eller ']'", buffer, pos)
+        pos += 1
 
 
 def load_concerts(file: TextIOBase) -> list[Concert]:
     """Læs koncerter fra JSON fil."""
-    concerts_json = json.load(file)
-    concerts = [Concert.from_json(c) for c in concerts_json]
-    return concerts
+    return list(iter_concerts(file))
+
+
+def dump_concerts(concerts: Iterable[Concert], file: TextIOBase):
+    """Skriv koncerter til JSON fil en ad gangen."""
+    encoder = json.JSONEncoder()
+    file.write("[")
+    for i, concert in enumerate(concerts):
+        if i:
+            file.write(", ")
+        file.write(encoder.encode(concert.as_json()))
+    file.write("]")
+
+
+# Kompakt binært format i kolonner, fx til arkiver med mange koncerter.
+# Filen er MAGIC efterfulgt af zlib-komprimerede sektioner, hver med
+# længden foran (uint32):
+#   antal koncerter, spillestederne (unikke, \0-adskilt), spillested per
+#   koncert (uint16), dato (sekunder siden 1970, int64), pris (float64, NaN
+#   for ukendt), udsolgt (int8), titler, billede-URL'er, URL'er og tags
+#   (\0-adskilt, tags adskilt med \x1f).
+COMPACT_MAGIC = b"OKC1"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _pack_sections(sections: list[bytes]) -> bytes:
+    return b"".join(struct.pack("<I", len(s)) + s for s in sections)
+
+
+def _unpack_sections(data: bytes) -> list[bytes]:
+    sections = []
+    pos = 0
+    while pos < len(data):
+        (size,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        sections.append(data[pos:pos+size])
+        pos += size
+    return sections
+
+
+def _join(strings: Iterable[str]) -> bytes:
+    return "\0".join(strings).encode()
+
+
+def _split(data: bytes, count: int) -> list[str]:
+    return data.decode().split("\0") if count else []
+
+
+class ConcertTable:
+    """Koncerter i kolonner i stedet for et objekt per koncert.
+
+    Til arbejde med mange koncerter på en gang (sortering, filtrering,
+    arkiver). Spillesteder gemmes som numre i venues, datoer som sekunder
+    siden 1970 og ukendte priser som NaN.
+    """
+
+    COLUMNS = ("titles", "venue_nos", "seconds", "prices", "sold_outs",
+               "img_urls", "urls", "tags")
+
+    def __init__(self, venues: list[str] | None = None):
+        self.venues: list[str] = venues or []
+        self.titles: list[str] = []
+        self.venue_nos = array.array("H")
+        self.seconds = array.array("q")
+        self.prices = array.array("d")
+        self.sold_outs = array.array("b")
+        self.img_urls: list[str] = []
+        self.urls: list[str] = []
+        self.tags: list[list[str]] = []
+
+    @classmethod
+    def from_concerts(cls, concerts: Iterable[Concert]) -> "ConcertTable":
+        table = cls()
+        for concert in concerts:
+            table.append(concert)
+        return table
+
+    def append(self, concert: Concert):
+        try:
+            venue_no = self.venues.index(concert.venue)
+        except ValueError:
+            venue_no = len(self.venues)
+            self.venues.append(concert.venue)
+        self.titles.append(concert.title)
+        self.venue_nos.append(venue_no)
+        self.seconds.append(int((concert.date - _EPOCH).total_seconds()))
+        self.prices.append(math.nan if concert.price is None else concert.price)
+        self.sold_outs.append(concert.sold_out)
+        self.img_urls.append(concert.img_url)
+        self.urls.append(concert.url)
+        self.tags.append(concert.tags)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def __getitem__(self, i: int) -> Concert:
+        price = self.prices[i]
+        if math.isnan(price):
+            price = None
+        elif price.is_integer():
+            price = int(price)
+        return Concert(self.titles[i], self.venues[self.venue_nos[i]],
+                       _date(self.seconds[i]), price, bool(self.sold_outs[i]),
+                       self.img_urls[i], self.urls[i], list(self.tags[i]))
+
+    def __iter__(self) -> Iterator[Concert]:
+        return (self[i] for i in range(len(self)))
+
+    def take(self, rows: Iterable[int]) -> "ConcertTable":
+        """En ny tabel med de givne rækker i den givne rækkefølge."""
+        rows = list(rows)
+        table = ConcertTable(list(self.venues))
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            values = [column[i] for i in rows]
+            if isinstance(column, array.array):
+                values = array.array(column.typecode, values)
+            setattr(table, name, values)
+        return table
+
+    def sort_by(self, *columns: str) -> "ConcertTable":
+        """Sorter efter kolonnerne, fx sort_by("seconds", "venue_nos")."""
+        keys = [getattr(self, name) for name in columns]
+        rows = sorted(range(len(self)), key=lambda i: tuple(k[i] for k in keys))
+        return self.take(rows)
+
+    def filter(self, predicate: Callable[[int], bool]) -> "ConcertTable":
+        """Behold rækkerne hvor predicate(række) er sand."""
+        return self.take(i for i in range(len(self)) if predicate(i))
+
+    def venue_no(self, venue: str) -> int:
+        """Spillestedets nummer i venue_nos (-1 hvis det ikke er i tabellen)."""
+        return self.venues.index(venue) if venue in self.venues else -1
+
+
+@lru_cache(maxsize=4096)
+def _date(seconds: int) -> datetime:
+    return _EPOCH + timedelta(seconds=seconds)
+
+
+def dump_concerts_compact(concerts: Iterable[Concert] | ConcertTable,
+                          file: BufferedIOBase):
+    """Skriv koncerter i det kompakte binære format."""
+    table = concerts if isinstance(concerts, ConcertTable) \
+        else ConcertTable.from_concerts(concerts)
+    sections = [
+        struct.pack("<I", len(table)),
+        _join(table.venues),
+        table.venue_nos.tobytes(),
+        table.seconds.tobytes(),
+        table.prices.tobytes(),
+        table.sold_outs.tobytes(),
+        _join(table.titles),
+        _join(table.img_urls),
+        _join(table.urls),
+        _join("\x1f".join(tags) for tags in table.tags),
+    ]
+    file.write(COMPACT_MAGIC)
+    file.write(zlib.compress(_pack_sections(sections)))
+
 
+def load_table_compact(file: BufferedIOBase) -> ConcertTable:
+    """Læs koncerter fra det kompakte binære format som en tabel."""
+    if file.read(len(COMPACT_MAGIC)) != COMPACT_MAGIC:
+        raise ValueError("Ikke en kompakt koncertfil")
+    (count_data, venues_data, venue_nos_data, dates_data, prices_data,
+     sold_outs_data, titles_data, img_urls_data, urls_data,
+     tags_data) = _unpack_sections(zlib.decompress(file.read()))
+    (count,) = struct.unpack("<I", count_data)
+    table = ConcertTable([sys.intern(v) for v in _split(venues_data, count)])
+    table.venue_nos.frombytes(venue_nos_data)
+    table.seconds.frombytes(dates_data)
+    table.prices.frombytes(prices_data)
+    table.sold_outs.frombytes(sold_outs_data)
+    table.titles = _split(titles_data, count)
+    table.img_urls = _split(img_urls_data, count)
+    table.urls = _split(urls_data, count)
+    table.tags = [[sys.intern(tag) for tag in tags.split("\x1f")] if tags else []
+                  for tags in _split(tags_data, count)]
+    return table
 
-def dump_concerts(concerts: list[Concert], file: TextIOBase):
-    """Skriv koncerter til JSON fil."""
-    concerts_json = [concert.as_json() for concert in concerts]
-    json.dump(concerts_json, file)
 
+def load_concerts_compact(file: BufferedIOBase) -> list[Concert]:
+    """Læs koncerter fra det kompakte binære format."""
+    return list(load_table_compact(file))
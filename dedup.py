@@ -0,0 +1,162 @@
+import re
+from collections import defaultdict
+from datetime import date, datetime, time
+from urllib.parse import urlsplit
+
+import metrics
+from concert import Concert
+from searchindex import normalize
+
+
+# Finder den samme koncert fra flere kilder (eller to gange fra samme
+# kilde) og slår dem sammen til én.
+#
+# Koncerterne deles i blokke efter dag og spillested, og inden for en blok
+# sammenlignes kun koncerter der har et ord til fælles i titlen (fundet
+# med et indeks fra ord til koncerter). Så skalerer det med antallet af
+# koncerter, også med mange kilder og flere års arkiv.
+
+
+# Ord der ikke siger noget om hvilken koncert det er
+STOPWORDS = {"feat", "ft", "featuring", "og", "and", "med", "with", "live", "koncert"}
+# Hvor stor en del af den korteste titels ord der skal være i den anden
+MIN_OVERLAP = 0.8
+# Hvor stor en del af alle ordene der skal være fælles (Jaccard)
+MIN_JACCARD = 0.5
+
+# Kilderne (URL'ens domæne) efter prioritet: spillestedernes egne sider før
+# de samlede sider. Ved dubletter beholdes koncerten fra den første kilde.
+SOURCE_PRIORITY = [
+    "postenlive.dk",
+    "dexter.dk",
+    "odeonodense.dk",
+    "grandodense.dk",
+    "odensevaerket.dk",
+    "stormspakhus.dk",
+    "tcbunderground.com",
+    "kulturmaskinen.dk",
+    "yourticket.dk",
+    "liveculture.dk",
+]
+
+re_word = re.compile(r"\w+")
+
+
+def title_words(title: str) -> frozenset[str]:
+    """De ord i titlen der sammenlignes."""
+    title = normalize(title)
+    words = frozenset(w for w in re_word.findall(title) if w not in STOPWORDS)
+    # Titler uden andre ord end stopord sammenlignes som de er
+    return words or frozenset([title])
+
+
+def source(concert: Concert) -> str:
+    """Koncertens kilde: domænet i URL'en (som i SOURCE_PRIORITY)."""
+    return (urlsplit(concert.url).hostname or "").removeprefix("www.")
+
+
+def source_rank(concert: Concert) -> int:
+    try:
+        return SOURCE_PRIORITY.index(source(concert))
+    except ValueError:
+        return len(SOURCE_PRIORITY)
+
+
+def block_key(concert: Concert) -> tuple[date, str]:
+    return (concert.date.date(), normalize(concert.venue))
+
+
+def known_time(concert: Concert) -> datetime | None:
+    """Koncertens tidspunkt, eller None hvis klokken ikke kendes (midnat)."""
+    return None if concert.date.time() == time() else concert.date
+
+
+def similar(a: frozenset[str], b: frozenset[str]) -> bool:
+    common = len(a & b)
+    return (common / min(len(a), len(b)) >= MIN_OVERLAP
+            and common / len(a | b) >= MIN_JACCARD)
+
+
+def find_duplicates(concerts: list[Concert]) -> list[list[int]]:
+    """Grupper (pladser i listen) af koncerter der er den samme koncert.
+
+    Kun grupper med mere end én koncert returneres.
+    """
+    words = [title_words(c.title) for c in concerts]
+    blocks: dict[tuple[date, str], list[int]] = defaultdict(list)
+    for i, concert in enumerate(concerts):
+        blocks[block_key(concert)].append(i)
+    # Union-find over koncerterne. Hver gruppe har højst ét kendt tidspunkt
+    # (gemt ved roden), så koncerter med forskellige kendte tidspunkter
+    # aldrig ender i samme gruppe, heller ikke gennem en uden klokkeslæt.
+    parent = list(range(len(concerts)))
+    group_time = [known_time(c) for c in concerts]
+
+    def root(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        index: dict[str, list[int]] = defaultdict(list)
+        # Koncerter med præcis samme nøgle er altid dubletter
+        first_with_key: dict[tuple, int] = {}
+        for i in block:
+            j = first_with_key.setdefault(concerts[i].key, i)
+            if j != i:
+                parent[root(i)] = root(j)
+                continue
+            candidates = {j for word in words[i] for j in index[word]}
+            for j in candidates:
+                (ri, rj) = (root(i), root(j))
+                if ri == rj or not similar(words[i], words[j]):
+                    continue
+                (ti, tj) = (group_time[ri], group_time[rj])
+                if ti is not None and tj is not None and ti != tj:
+                    continue
+                parent[ri] = rj
+                group_time[rj] = ti or tj
+            for word in words[i]:
+                index[word].append(i)
+    groups: dict[int, list[int]] = defaultdict(list)
+    for i in range(len(concerts)):
+        groups[root(i)].append(i)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def merge(duplicates: list[Concert]) -> Concert:
+    """Slå dubletter sammen.
+
+    Koncerten fra kilden med højest prioritet vinder, men pris, billede og
+    klokkeslæt tages fra de andre hvis den mangler dem.
+    """
+    ranked = sorted(duplicates, key=source_rank)
+    best = ranked[0]
+    date = next((c.date for c in ranked if c.date.time() != time()), best.date)
+    price = next((c.price for c in ranked if c.price is not None), None)
+    img_url = next((c.img_url for c in ranked if c.img_url), best.img_url)
+    tags = sorted(set().union(*(c.tags for c in ranked)))
+    return Concert(best.title, best.venue, date, price, best.sold_out,
+                   img_url, best.url, tags)
+
+
+@metrics.stage("dedup")
+def dedup(concerts: list[Concert]) -> list[Concert]:
+    """Fjern dubletter. Returner i samme rækkefølge som all_concerts."""
+    print("Fjerner dubletter...")
+    groups = find_duplicates(concerts)
+    merged: dict[int, Concert] = {}
+    removed = set()
+    for group in groups:
+        duplicates = [concerts[i] for i in group]
+        merged[group[0]] = merge(duplicates)
+        removed.update(group[1:])
+        print("    " + " = ".join(f"{c.title} ({c.venue})" for c in duplicates))
+    result = [merged.get(i, c) for (i, c) in enumerate(concerts) if i not in removed]
+    result.sort(key=lambda c: (c.date, c.venue, c.title))
+    metrics.add("duplicates", len(removed))
+    print(f"Færdig! {len(removed)} dubletter fjernet")
+    return result
@@ -0,0 +1,346 @@
+import concurrent.futures
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, TypeVar
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+import metrics
+
+
+# Fælles HTTP-lag som alle scrapere og billedhentningen går igennem.
+# Forbindelserne genbruges (keep-alive) per vært, antallet af samtidige
+# forespørgsler per vært er begrænset, og alt har timeout og genforsøg.
+#
+# Svarene gemmes i en cache på disken. Ved næste kørsel sendes
+# If-None-Match/If-Modified-Since så uændrede sider kommer som 304 og
+# læses fra disken. Med OFFLINE = True bruges kun cachen (ingen netværk).
+
+
+# (connect, read) i sekunder
+TIMEOUT = (5, 30)
+# Højeste antal samtidige forespørgsler til den samme vært
+MAX_PER_HOST = 4
+# Antal værter der holdes forbindelser åbne til
+MAX_HOSTS = 32
+# Højeste antal samtidige hentninger i én scraper (fx detaljesider)
+MAX_FAN_OUT = 8
+
+CACHE_DIR = Path(".cache/http")
+# Kør kun fra cachen. Sættes fx med --offline.
+OFFLINE = False
+# Hvor længe (sekunder) et svar bruges uden at spørge serveren, per vært.
+# Bruges til kilder uden ETag/Last-Modified hvor data sjældent ændres.
+# Enkelte sider kan få deres egen ttl i fetch.get (fx Odeons koncertsider).
+CACHE_TTL: dict[str, float] = {}
+DEFAULT_TTL = 0
+# Svar der ikke er brugt i denne kørsel slettes fra cachen når de er så
+# mange dage gamle (se prune_cache).
+CACHE_MAX_AGE_DAYS = 7
+
+RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    # Også POST, da vores POST-forespørgsler kun henter data.
+    allowed_methods=None,
+)
+
+
+class OfflineError(Exception):
+    """Svaret findes ikke i cachen og netværket må ikke bruges."""
+
+
+class DeadlineExceeded(Exception):
+    """Tiden er gået for den der henter (fx en scraper), eller den er afbrudt."""
+
+
+class Deadline:
+    """Frist for alle forespørgsler i en blok (se deadline).
+
+    Forespørgsler efter fristen fejler med DeadlineExceeded, og timeout
+    skæres ned så ingen forespørgsel går ud over fristen. cancel afbryder
+    med det samme, fx fra en anden tråd.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.at = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+
+    def start(self):
+        """Start fristen forfra, fx når arbejdet faktisk går i gang."""
+        self.at = time.monotonic() + self.seconds
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def remaining(self) -> float:
+        if self._cancelled.is_set():
+            return 0.0
+        return max(0.0, self.at - time.monotonic())
+
+    def check(self, url: str):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(url)
+
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    # Svar der kom fra cachen (også 304)
+    cached: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+    # Svartid for hver forespørgsel over netværket
+    latencies: list[float] = field(default_factory=list)
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=MAX_HOSTS,
+                          pool_maxsize=MAX_PER_HOST,
+                          max_retries=RETRY)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+_session = _make_session()
+_lock = threading.Lock()
+# Nøgler i cachen der er brugt i denne kørsel
+_used_keys: set[str] = set()
+_semaphores: dict[str, threading.BoundedSemaphore] = {}
+_stats: dict[str, HostStats] = defaultdict(HostStats)
+_deadline: contextvars.ContextVar[Deadline | None] = \
+    contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(d: Deadline):
+    """Alle forespørgsler i blokken (også fra map_concurrent) har fristen d."""
+    token = _deadline.set(d)
+    try:
+        yield d
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def _host_slot(host: str):
+    """Vent på en ledig plads hos værten."""
+    with _lock:
+        if host not in _semaphores:
+            _semaphores[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        semaphore = _semaphores[host]
+    with semaphore:
+        yield
+
+
+def _cache_key(method: str, url: str, kwargs: dict) -> str:
+    body = [kwargs.get("params"), kwargs.get("data"), kwargs.get("json")]
+    key = json.dumps([method, url, body], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _cache_load(key: str) -> tuple[dict, bytes] | None:
+    try:
+        meta = json.loads((CACHE_DIR / f"{key}.json").read_text())
+        body = (CACHE_DIR / f"{key}.body").read_bytes()
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return (meta, body)
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _cache_store(key: str, meta: dict, body: bytes | None = None):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    if body is not None:
+        _write_atomic(CACHE_DIR / f"{key}.body", body)
+    _write_atomic(CACHE_DIR / f"{key}.json", json.dumps(meta).encode())
+
+
+def _cached_response(meta: dict, body: bytes) -> requests.Response:
+    """Byg et svar ud fra cachen."""
+    r = requests.Response()
+    r.status_code = meta["status"]
+    r.url = meta["url"]
+    r.headers = CaseInsensitiveDict(meta["headers"])
+    r.encoding = meta["encoding"]
+    r._content = body
+    return r
+
+
+def _record(host: str, elapsed: float, size: int, cached: bool,
+            network: bool = True):
+    with _lock:
+        stats = _stats[host]
+        stats.requests += 1
+        stats.cached += cached
+        stats.seconds += elapsed
+        stats.bytes += size
+        if network:
+            stats.latencies.append(elapsed)
+    metrics.add("requests")
+    metrics.add("cached", cached)
+    metrics.add("bytes", size)
+    metrics.add("http_s", elapsed)
+
+
+def request(method: str, url: str, *, cache: bool = True,
+            ttl: float | None = None, **kwargs) -> requests.Response:
+    """Send en forespørgsel gennem den fælles session.
+
+    Med cache=False gemmes svaret ikke (bruges fx til billeder). ttl
+    overskriver CACHE_TTL for værten.
+    """
+    host = urlsplit(url).hostname
+    kwargs.setdefault("timeout", TIMEOUT)
+    if not cache:
+        if OFFLINE:
+            raise OfflineError(url)
+        return _request(host, method, url, kwargs)
+    key = _cache_key(method, url, kwargs)
+    with _lock:
+        _used_keys.add(key)
+    entry = _cache_load(key)
+    if OFFLINE:
+        if entry is None:
+            raise OfflineError(url)
+        _record(host, 0.0, 0, cached=True, network=False)
+        return _cached_response(*entry)
+    if entry is not None:
+        (meta, body) = entry
+        if ttl is None:
+            ttl = CACHE_TTL.get(host.removeprefix("www."), DEFAULT_TTL)
+        if time.time() - meta["fetched"] < ttl:
+            _record(host, 0.0, 0, cached=True, network=False)
+            return _cached_response(meta, body)
+        headers = dict(kwargs.get("headers") or {})
+        if "etag" in meta["headers"]:
+            headers["If-None-Match"] = meta["headers"]["etag"]
+        if "last-modified" in meta["headers"]:
+            headers["If-Modified-Since"] = meta["headers"]["last-modified"]
+        kwargs["headers"] = headers
+    r = _request(host, method, url, kwargs)
+    if r.status_code == 304 and entry is not None:
+        (meta, body) = entry
+        meta["fetched"] = time.time()
+        _cache_store(key, meta)
+        return _cached_response(meta, body)
+    meta = {
+        "url": r.url,
+        "status": r.status_code,
+        "headers": {h.lower(): v for (h, v) in r.headers.items()
+                    if h.lower() in ("etag", "last-modified", "content-type")},
+        "encoding": r.encoding,
+        "fetched": time.time(),
+    }
+    _cache_store(key, meta, r.content)
+    return r
+
+
+def _request(host: str, method: str, url: str, kwargs: dict) -> requests.Response:
+    d = _deadline.get()
+    if d is not None:
+        d.check(url)
+        remaining = d.remaining()
+        (connect, read) = kwargs["timeout"]
+        kwargs = kwargs | {"timeout": (min(connect, remaining), min(read, remaining))}
+    with _host_slot(host):
+        if d is not None:
+            # Der kan være ventet på pladsen
+            d.check(url)
+        start = time.perf_counter()
+        r = _session.request(method, url, **kwargs)
+        # Læs hele svaret mens vi stadig har pladsen hos værten
+        size = len(r.content)
+        elapsed = time.perf_counter() - start
+    _record(host, elapsed, size, cached=r.status_code == 304)
+    r.raise_for_status()
+    return r
+
+
+def prune_cache(max_age_days: float = CACHE_MAX_AGE_DAYS) -> int:
+    """Slet svar der ikke er brugt i denne kørsel og er ældre end max_age_days.
+
+    Så vokser cachen ikke med detaljesider for koncerter der er forbi.
+    Svar fra scrapere der fejlede i dag beholdes indtil de er for gamle.
+    Returner antallet af slettede svar.
+    """
+    cutoff = time.time() - max_age_days * 24 * 3600
+    removed = 0
+    for meta_path in CACHE_DIR.glob("*.json"):
+        key = meta_path.stem
+        if key in _used_keys:
+            continue
+        try:
+            fetched = json.loads(meta_path.read_text())["fetched"]
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            fetched = 0
+        if fetched < cutoff:
+            meta_path.unlink(missing_ok=True)
+            (CACHE_DIR / f"{key}.body").unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+def map_concurrent(fn: Callable[[T], R], items: Iterable[T]) -> list[R]:
+    """Kald fn på alle elementer samtidigt. Resultaterne har samme rækkefølge.
+
+    Antallet af samtidige forespørgsler per vært er stadig begrænset af
+    MAX_PER_HOST, så dette kan bruges sikkert til detaljesider og sider.
+    Fristen (deadline) og målingerne gælder også i de andre tråde.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    workers = min(MAX_FAN_OUT, len(items))
+    context = contextvars.copy_context()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda item: context.copy().run(fn, item), items))
+
+
+def stats() -> dict[str, HostStats]:
+    """Returner statistik over forespørgsler per vært."""
+    with _lock:
+        return {host: HostStats(s.requests, s.cached, s.seconds, s.bytes,
+                                list(s.latencies))
+                for (host, s) in _stats.items()}
+
+
+def print_stats():
+    """Udskriv statistik over forespørgsler per vært."""
+    print("Forespørgsler per vært:")
+    for host, s in sorted(stats().items(), key=lambda i: -i[1].seconds):
+        print(f"    {host}: {s.requests} forespørgsler ({s.cached} fra cache), "
+              f"{s.seconds:.2f} s, {s.bytes / 1024:.0f} KiB")
@@ -1,137 +1,217 @@
 // This function drives the filters.
 //
 // It is wrapped in a function to avoid scoping issues.
+//
+// The filters run against search-index.json, which is built together with
+// the page (see searchindex.py). It holds the normalized titles, dates as
+// days since 1970, category flags and a trigram index, so every filter
+// change is a single pass over a few arrays instead of over the DOM.
+//
+// If the index is missing (e.g. a page rendered before it existed) the
+// filters fall back to reading the titles and dates from the cards.
 
 (function () {
-  const concerts = document.getElementsByClassName("concert");
+  const months = document.getElementsByClassName("month");
 
   const quizFilter = document.getElementById("hide-quizzes");
-  quizFilter.addEventListener("input", filterAll);
+  quizFilter.addEventListener("input", filterChanged);
   const jamFilter = document.getElementById("hide-jams");
-  jamFilter.addEventListener("input", filterAll);
+  jamFilter.addEventListener("input", filterChanged);
   //const jazzFestFilter = document.getElementById("hide-jazz-fest");
-  //jazzFestFilter.addEventListener("input", filterAll);
+  //jazzFestFilter.addEventListener("input", filterChanged);
   const nashvilleFilter = document.getElementById("hide-nashville");
-  nashvilleFilter.addEventListener("input", filterAll);
+  nashvilleFilter.addEventListener("input", filterChanged);
 
   const searchField = document.getElementById("search");
-  searchField.addEventListener("input", filterAll);
-
-  function filterAll(event) {
-    showAll();
-    hideOldConcerts();
-    hideByQuizFilter();
-    hideByJamFilter();
-    //hideByJazzFestFilter();
-    hideByNashvilleFilter();
-    hideBySearch();
+  searchField.addEventListener("input", filterChanged);
+
+  // Must match the bits in searchindex.py.
+  const QUIZ = 1;
+  const JAM = 2;
+  const JAZZ_FEST = 4;
+  const NASHVILLE = 8;
+
+  const indexUrl = document.querySelector("main").dataset.searchIndex;
+  let index = null;
+  // Set when the index could not be loaded, see filterPage.
+  let noIndex = false;
+  // Whether each concert (by id) passes the filters.
+  let visible = [];
+
+  // Only the first months are in the page. The rest are fetched one at a
+  // time when the end of the list is scrolled into view, or when a search
+  // matches concerts in them.
+  const lazyMonths = new Map();
+  for (const month of document.querySelectorAll(".month[data-src]")) {
+    lazyMonths.set(month.dataset.month, month);
   }
-
-  const jamRegexes = [
-    /jazz jam.*/,
-    /dexter jam.*/,
-    /blue monday blues jam/,
-    /jamsession v\..* \/\/ odense jazz festival/,
-    /jam night.*nashville nights 2026/,
-  ];
-
-  const jazzFestConcerts = new Set([
-    "m. o. n. g. // odense jazz festival",
-    "fini sings with strings",
-    "britta virves trio // odense jazz festival",
-    "carl winther trio feat. randy brecker",
-    "anna pauline group feat. randy brecker, janis siegel, john di martino // odense jazz festival",
-    "masterclass v. janis siegel // odense jazz festival",
-    "viktoria søndergaard music of secrets",
-    "jakob dinesen – slow flow // odense jazz festival",
-    "jamsession v. simon krebs // odense jazz festival",
-    "elements  of  refusal",
-    "jamsession v. chano olskær // odense jazz festival",
-    "kresten osgood quintet 100 år med dansk jazz // odense jazz festival",
-    "tribute to thilo",
-    "buki yamaz // odense jazz festival",
-    "jamsession v. søren høst // odense jazz festival",
-    "øjne & ører: ki!",
-    "giacomo smith ? joe webb ? snorre kirk ? anders fjelds",
-    "odense jazz orchestra plays dąbrowski // odense jazz festival",
-  ]);
-
-  function showAll() {
-    for (const concert of concerts) {
-      concert.hidden = false;
+  const loadingMonths = new Map();
+
+  function loadMonth(month) {
+    if (!loadingMonths.has(month)) {
+      const promise = fetch(month.dataset.src)
+        .then((response) => {
+          if (!response.ok) throw new Error(response.statusText);
+          return response.text();
+        })
+        .then((html) => {
+          month.innerHTML = html;
+          delete month.dataset.src;
+          if (index !== null) applyVisible(month);
+          if (noIndex) filterPage();
+          return true;
+        })
+        .catch(() => {
+          // Allow another try later, the link still works meanwhile.
+          loadingMonths.delete(month);
+          return false;
+        });
+      loadingMonths.set(month, promise);
     }
+    return loadingMonths.get(month);
   }
 
-  function hideOldConcerts() {
-    const now = new Date();
-    const today = new Date(now.getFullYear(), now.getMonth(), now.getDate());
-
-    const concerts = document.querySelectorAll(".concert");
-    for (const concert of concerts) {
-      const time = concert.querySelector("time");
-      const concertDate = new Date(time.dateTime);
-      if (concertDate < today) {
-        concert.hidden = true;
+  const monthObserver = new IntersectionObserver((entries) => {
+    for (const entry of entries) {
+      if (!entry.isIntersecting) continue;
+      monthObserver.unobserve(entry.target);
+      loadMonth(entry.target).then((loaded) => {
+        if (loaded) observeNextMonth();
+      });
+    }
+  }, { rootMargin: "1000px" });
+
+  function observeNextMonth() {
+    for (const month of lazyMonths.values()) {
+      if (!loadingMonths.has(month)) {
+        monthObserver.observe(month);
+        return;
       }
     }
   }
 
-  function hideByQuizFilter() {
-    const isActivated = quizFilter.checked;
-    if (!isActivated) return;
-
-    for (const concert of concerts) {
-      const title = concert.getAttribute("data-title");
-      // I hope no band name includes "quiz"...
-      const isQuiz = title.includes("quiz");
-      concert.hidden = concert.hidden || isQuiz;
+  function filterChanged(event) {
+    if (noIndex) {
+      // Without the index it is unknown which months have results.
+      lazyMonths.forEach(loadMonth);
+      filterPage();
+      return;
+    }
+    if (index === null) return;
+    filterAll(event);
+    // Fetch the months with search results straight away.
+    if (searchField.value === "") return;
+    for (let id = 0; id < visible.length; id++) {
+      if (!visible[id]) continue;
+      const month = lazyMonths.get(index.months[index.month[id]]);
+      if (month && !loadingMonths.has(month)) loadMonth(month);
     }
   }
 
-  function hideByJamFilter() {
-    const isActivated = jamFilter.checked;
-    if (!isActivated) return;
+  function hiddenFlags() {
+    return (
+      (quizFilter.checked ? QUIZ : 0) |
+      (jamFilter.checked ? JAM : 0) |
+      //(jazzFestFilter.checked ? JAZZ_FEST : 0) |
+      (nashvilleFilter.checked ? NASHVILLE : 0));
+  }
 
-    for (const concert of concerts) {
-      const title = concert.getAttribute("data-title");
-      const isJam = jamRegexes.some((r) => r.test(title));
-      concert.hidden = concert.hidden || isJam;
+  function filterAll(event) {
+    const hidden = hiddenFlags();
+    const text = searchField.value.normalize("NFC").toLowerCase();
+    const candidates = searchCandidates(text);
+    const today = todayInDays();
+
+    const count = index.titles.length;
+    visible = new Array(count);
+    for (let id = 0; id < count; id++) {
+      visible[id] =
+        index.days[id] >= today &&
+        (index.flags[id] & hidden) === 0 &&
+        (candidates === null || candidates.has(id)) &&
+        index.titles[id].includes(text);
+    }
+    for (const month of months) {
+      applyVisible(month);
     }
   }
 
-  function hideByJazzFestFilter() {
-    const isActivated = jazzFestFilter.checked;
-    if (!isActivated) return;
+  // Must match the rules for these tags in tagging.py.
+  const FLAG_RULES = [
+    [QUIZ, /quiz/],
+    [JAM, /jazz jam|dexter jam|blue monday blues jam|jamsession v\..* \/\/ odense jazz festival|jam night.*nashville nights 2026/],
+    [NASHVILLE, /nashville nights/],
+  ];
 
-    for (const concert of concerts) {
-      const title = concert.getAttribute("data-title");
-      const isJazzFest = jazzFestConcerts.has(title);
-      concert.hidden = concert.hidden || isJazzFest;
+  // The filters without the index: straight from the cards in the page.
+  function filterPage() {
+    const hidden = hiddenFlags();
+    const text = searchField.value.normalize("NFC").toLowerCase();
+    const today = todayInDays();
+    for (const concert of document.getElementsByClassName("concert")) {
+      const title = concert.querySelector("h2").textContent.normalize("NFC").toLowerCase();
+      // The date part is parsed as UTC, like the days in the index.
+      const dateTime = concert.querySelector("time").dateTime;
+      const days = Math.floor(Date.parse(dateTime.slice(0, 10)) / 86400000);
+      let flags = 0;
+      for (const [flag, rule] of FLAG_RULES) {
+        if (rule.test(title)) flags |= flag;
+      }
+      concert.hidden = !(days >= today && (flags & hidden) === 0 && title.includes(text));
     }
   }
 
-  function hideByNashvilleFilter() {
-    const isActivated = nashvilleFilter.checked;
-    if (!isActivated) return;
-
-    for (const concert of concerts) {
-      const title = concert.getAttribute("data-title");
-      const isNashville = title.includes("nashville nights");
-      concert.hidden = concert.hidden || isNashville;
+  // Cards only know their position within their month, so that a month
+  // can be rebuilt without changing the others.
+  function applyVisible(month) {
+    const start = index.start[index.months.indexOf(month.dataset.month)];
+    for (const concert of month.getElementsByClassName("concert")) {
+      concert.hidden = !visible[start + Number(concert.dataset.pos)];
     }
   }
 
-  function hideBySearch() {
-    const text = searchField.value.toLowerCase();
-
-    for (const concert of concerts) {
-      const title = concert.getAttribute("data-title");
-      const isMatch = title.includes(text);
-      concert.hidden = concert.hidden || !isMatch;
+  // Returns the ids that contain every trigram of the text, or null if
+  // the text is too short to use the trigram index.
+  function searchCandidates(text) {
+    // Code points, like Python strings.
+    const chars = Array.from(text);
+    if (chars.length < 3) return null;
+    const postings = [];
+    for (let i = 0; i + 3 <= chars.length; i++) {
+      const ids = index.trigrams[chars.slice(i, i + 3).join("")];
+      if (ids === undefined) return new Set();
+      postings.push(ids);
+    }
+    postings.sort((a, b) => a.length - b.length);
+    let result = new Set(postings[0]);
+    for (const ids of postings.slice(1)) {
+      const next = new Set(ids);
+      result = new Set([...result].filter((id) => next.has(id)));
     }
+    return result;
+  }
+
+  function todayInDays() {
+    const now = new Date();
+    return Math.floor(
+      Date.UTC(now.getFullYear(), now.getMonth(), now.getDate()) / 86400000);
   }
 
   // Run the filters to hide old concerts.
-  filterAll(null);
+  const indexLoaded = indexUrl === undefined
+    ? Promise.reject(new Error("no search index"))
+    : fetch(indexUrl).then((response) => {
+        if (!response.ok) throw new Error(response.statusText);
+        return response.json();
+      });
+  indexLoaded
+    .then((data) => {
+      index = data;
+      filterAll(null);
+    })
+    .catch(() => {
+      noIndex = true;
+      filterPage();
+    });
+  observeNextMonth();
 })();
-
@@ -0,0 +1,155 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Callable, Iterator
+
+
+# Målinger af en kørsel: tid per trin (stage) og tællere (forespørgsler,
+# bytes, parsede events, ...) som koden lægger til det trin den kører i.
+# Trinene kan ligge i hinanden, fx hver scraper under "all_concerts".
+# Til sidst skrives det hele som JSON (REPORT_PATH) så kørsler kan
+# sammenlignes fra dag til dag. Rapporten ligger i .cache og ikke i git,
+# da tiderne ændrer sig ved hver kørsel (workflowet gemmer den som artifact).
+
+
+REPORT_PATH = Path(".cache/run-report.json")
+
+
+@dataclass
+class Stage:
+    name: str
+    wall_s: float = 0.0
+    # CPU-tid for processen, eller kun trådens hvis trinet er én tråd (fx
+    # en scraper). Arbejde i andre processer tælles som tællere.
+    cpu_s: float = 0.0
+    counters: dict[str, float] = field(default_factory=dict)
+    stages: list["Stage"] = field(default_factory=list)
+    # Fejl der ikke stoppede kørslen (fx en scraper der fejlede)
+    errors: list[str] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False,
+                                  compare=False)
+
+    def add(self, counter: str, amount: float = 1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def as_json(self) -> dict:
+        return {
+            "name": self.name,
+            "wall_s": round(self.wall_s, 4),
+            "cpu_s": round(self.cpu_s, 4),
+            "counters": {k: round(v, 4) for (k, v) in sorted(self.counters.items())},
+            "stages": [s.as_json() for s in self.stages],
+            "errors": list(self.errors),
+        }
+
+
+_current: ContextVar[Stage | None] = ContextVar("stage", default=None)
+_lock = threading.Lock()
+_stages: list[Stage] = []
+_started = datetime.now()
+
+
+@contextmanager
+def stage(name: str, thread: bool = False) -> Iterator[Stage]:
+    """Mål et trin. Kan også bruges som dekorator.
+
+    Med thread=True måles kun CPU-tiden i den nuværende tråd.
+    """
+    cpu_clock = time.thread_time if thread else time.process_time
+    s = Stage(name)
+    parent = _current.get()
+    with _lock:
+        (parent.stages if parent else _stages).append(s)
+    token = _current.set(s)
+    wall = time.perf_counter()
+    cpu = cpu_clock()
+    try:
+        yield s
+    finally:
+        s.wall_s = time.perf_counter() - wall
+        s.cpu_s = cpu_clock() - cpu
+        _current.reset(token)
+
+
+def add(counter: str, amount: float = 1):
+    """Læg til en tæller i det nuværende trin (gør intet uden for et trin)."""
+    s = _current.get()
+    if s is not None:
+        s.add(counter, amount)
+
+
+def error(message: str):
+    """Notér en fejl i det nuværende trin."""
+    s = _current.get()
+    if s is not None:
+        with s._lock:
+            s.errors.append(message)
+
+
+def propagate(fn: Callable) -> Callable:
+    """fn der tæller med i det nuværende trin, også når den kaldes fra
+    en anden tråd (fx i en ThreadPoolExecutor)."""
+    s = _current.get()
+
+    @wraps(fn)
+    def run(*args, **kwargs):
+        token = _current.set(s)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def report(hosts: dict | None = None) -> dict:
+    """Kørslens målinger. hosts er fetch.stats()."""
+    hosts = hosts or {}
+    with _lock:
+        stages = [s.as_json() for s in _stages]
+    return {
+        "started": _started.isoformat(timespec="seconds"),
+        "wall_s": round((datetime.now() - _started).total_seconds(), 4),
+        "stages": stages,
+        "hosts": {
+            host: {
+                "requests": s.requests,
+                "cached": s.cached,
+                "bytes": s.bytes,
+                "seconds": round(s.seconds, 4),
+                "p50_s": round(percentile(s.latencies, 0.5), 4),
+                "p95_s": round(percentile(s.latencies, 0.95), 4),
+                "max_s": round(max(s.latencies, default=0.0), 4),
+            }
+            for (host, s) in sorted(hosts.items())
+        },
+    }
+
+
+def write_report(path: Path = REPORT_PATH, hosts: dict | None = None):
+    """Gem kørslens målinger som JSON."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(report(hosts), file, indent=1, ensure_ascii=False)
+        file.write("\n")
+
+
+def reset():
+    """Glem alle målinger (fx mellem benchmarks)."""
+    global _started
+    with _lock:
+        _stages.clear()
+        _started = datetime.now()
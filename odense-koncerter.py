@@ -1,15 +1,24 @@
-import concurrent.futures
+import argparse
+import hashlib
 import io
+import itertools
+import json
 import locale
+import os
+from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 from pprint import pprint
 
-import requests
 from jinja2 import Environment, PackageLoader, select_autoescape
-from PIL import Image
 
+import archive
+import dedup
+import fetch
+import metrics
 import scrapers
+import searchindex
+import thumbnails
 from concert import Concert, load_concerts, dump_concerts
 
 
@@ -17,8 +26,7 @@ from concert import Concert, load_concerts, dump_concerts
 
 
 # TODO
-# - Genrer ville være fedt
-# - Black-list til alt som ikke er koncerter (som systemet ikke fanger selv)
+# - Genrer ville være fedt (kan laves som regler i tagging.py)
 # - Gør så man kan køre programmet fra andre mapper end den filen er i
 # - Brug tråde til at lave miniaturer (thumbnails)
 # - Nogle steder er der ikke år med i datoen, her antager jeg at det er i år
@@ -30,76 +38,224 @@ from concert import Concert, load_concerts, dump_concerts
 locale.setlocale(locale.LC_ALL, "da_DK.utf8")
 
 
-def get_image(url: str) -> Image.Image:
-    """Hent billede fra URL."""
-    r = requests.get(url, stream=True)
-    f = io.BytesIO(r.content)
-    return Image.open(f)
-
-
-def make_thumbnail(concert: Concert) -> str:
-    """Hent koncertens billede og gem optimeret miniature. Returner ny URL."""
-    name = f"{concert.date.date()} - {concert.venue} - {concert.title}.webp"
-    # Fjern alle tegn der ikke må være i filnavne
-    escaped_name = name.translate(str.maketrans("", "", "<>:\"/\\|?*"))
-    path = Path("images") / escaped_name
-    if not path.exists():
-        img = get_image(concert.img_url)
-        if img.width < 768:
-            print(f"WARN: Image < 768px, {name}")
-        if img.width < img.height:
-            print(f"WARN: Portrait image, {name}")
-        img.thumbnail((768, 768))
-        img.save(path, "WebP", lossless=False, quality=80)
-    concert.img_url = str(path)
-    return str(path)
+def format_price(f: float) -> str:
+    format_str = "%i" if f.is_integer() else "%.2f"
+    return locale.format_string(format_str, f, grouping=True) + " kr."
 
 
-def make_thumbnails(concerts: list[Concert]):
-    """Lav miniature til koncerterne og opdater billede-URL'erne."""
-    print("Laver thumbnails...")
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        executor.map(make_thumbnail, concerts)
-    print("Færdig med thumbnails!")
+# Antal måneder der står direkte i index.html. Resten hentes når de skal vises.
+EAGER_MONTHS = 2
+# Fingeraftryk af det der sidst blev udskrevet, så uændrede sider springes over
+RENDER_STATE = "render-state.json"
 
 
-def format_price(f: float) -> str:
-    format_str = "%i" if f.is_integer() else "%.2f"
-    return locale.format_string(format_str, f, grouping=True) + " kr."
+@dataclass
+class Month:
+    key: str
+    label: str
+    src: str
+    # (plads i måneden, koncert) par. Tom hvis måneden hentes senere.
+    concerts: list[tuple[int, Concert]] = field(default_factory=list)
 
 
-def make_html(out_path, concerts: list[Concert]):
-    """Lav en side med de givne koncerter og gem ved stien."""
-    print("Udskriver siden...")
+def make_environment() -> Environment:
     env = Environment(
         loader=PackageLoader("odense-koncerter"),
         autoescape=select_autoescape()
     )
     env.globals["format_price"] = format_price
-    template = env.get_template("index.html")
-    now = datetime.now()
-    with open(out_path, "w") as file:
-        file.write(template.render(now=now, concerts=concerts))
-    print("Færdig! Siden er udskrevet til", out_path)
+    env.globals["thumbnail_srcset"] = thumbnails.srcset
+    env.globals["thumbnail_formats"] = list(thumbnails.FORMATS)
+    env.globals["thumbnail_sizes"] = thumbnails.THUMBNAIL_SIZES
+    return env
+
+
+def fingerprint(*parts) -> str:
+    """Hash af JSON-data (fx koncerter) til at se om noget er ændret."""
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def templates_fingerprint() -> str:
+    """Hash af skabelonerne og indstillingerne der påvirker dem."""
+    templates = sorted(Path("templates").glob("*.html"))
+    return fingerprint([path.read_text() for path in templates],
+                       list(thumbnails.FORMATS), thumbnails.VARIANT_WIDTHS,
+                       thumbnails.THUMBNAIL_SIZES)
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """Skriv kun filen hvis indholdet er ændret. Returner om den blev skrevet.
+
+    Filen skrives til en midlertidig fil først, så den aldrig er halvt
+    skrevet (fx concerts.json, som næste kørsel falder tilbage på).
+    """
+    try:
+        if path.read_text() == content:
+            return False
+    except FileNotFoundError:
+        pass
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(content)
+    os.replace(tmp, path)
+    return True
 
 
+def load_render_state(path: Path) -> dict:
+    state = {"page": None, "updated": None, "months": {}}
+    try:
+        with open(path, "r") as file:
+            state |= json.load(file)
+    except FileNotFoundError:
+        pass
+    return state
+
+
+@metrics.stage("make_html")
+def make_html(out_path, concerts: list[Concert], eager_months: int = EAGER_MONTHS):
+    """Lav en side med de givne koncerter og gem ved stien.
+
+    De første eager_months måneder står direkte på siden, resten gemmes
+    som fragmenter i mappen months/ ved siden af, som siden henter senere.
+    Søgeindekset til filtrene gemmes i search-index.json ved siden af.
+
+    Siden og fragmenterne udskrives kun hvis deres koncerter eller
+    skabelonerne er ændret siden sidst (se render-state.json).
+    """
+    print("Udskriver siden...")
+    env = make_environment()
+    out_path = Path(out_path)
+    out_dir = out_path.parent
+    state_path = out_dir / RENDER_STATE
+    state = load_render_state(state_path)
+    templates = templates_fingerprint()
+    index_json = json.dumps(searchindex.build_index(concerts),
+                            separators=(",", ":"), ensure_ascii=False)
+    write_if_changed(out_dir / "search-index.json", index_json)
+    # Versionen sørger for at siden og indekset altid passer sammen
+    index_version = hashlib.sha256(index_json.encode()).hexdigest()[:12]
+    months_dir = out_dir / "months"
+    months_dir.mkdir(exist_ok=True)
+    month_template = env.get_template("month.html")
+    months = []
+    month_states = {}
+    written = set()
+    rendered = 0
+    by_month = itertools.groupby(concerts, key=lambda c: c.date.strftime("%Y-%m"))
+    for i, (key, month_concerts) in enumerate(by_month):
+        month_concerts = list(enumerate(month_concerts))
+        label = month_concerts[0][1].date.strftime("%B %Y")
+        path = months_dir / f"{key}.html"
+        month = Month(key, label, f"months/{path.name}")
+        if i < eager_months:
+            month.concerts = month_concerts
+        else:
+            month_fp = fingerprint(templates, [c.as_json() for (_, c) in month_concerts])
+            # Versionen sørger for at et fragment i browserens cache altid
+            # passer med indekset
+            month.src += f"?v={month_fp[:12]}"
+            if state["months"].get(key) != month_fp or not path.exists():
+                with open(path, "w") as file:
+                    file.write(month_template.render(concerts=month_concerts))
+                rendered += 1
+            month_states[key] = month_fp
+            written.add(path)
+        months.append(month)
+    # Fjern måneder der ikke længere er på siden
+    for path in months_dir.glob("*.html"):
+        if path not in written:
+            path.unlink()
+    # Med fragmenternes fingeraftryk, så "Sidst opdateret" og versionerne
+    # på siden følger med når en senere måned ændres (fx prisen)
+    page_fp = fingerprint(templates, index_version, month_states,
+                          [(m.key, m.label, [c.as_json() for (_, c) in m.concerts])
+                           for m in months])
+    if state["page"] != page_fp or not out_path.exists():
+        template = env.get_template("index.html")
+        now = datetime.now()
+        with open(out_path, "w") as file:
+            file.write(template.render(now=now, months=months,
+                                       index_version=index_version))
+        state["page"] = page_fp
+        state["updated"] = now.isoformat(timespec="seconds")
+        rendered += 1
+    state["months"] = month_states
+    metrics.add("concerts", len(concerts))
+    metrics.add("rendered", rendered)
+    write_if_changed(state_path, json.dumps(state, indent=1, sort_keys=True))
+    if rendered:
+        print(f"Færdig! Siden er udskrevet til {out_path} "
+              f"({rendered} af {len(written) + 1} filer ændret)")
+    else:
+        print("Færdig! Siden er uændret")
+
+
+@metrics.stage("save_concerts")
 def save_concerts(out_path, concerts: list[Concert]):
     """Gem koncerterne som JSON ved stien."""
     print("Gemmer som JSON...")
-    with open(out_path, "w") as file:
-        dump_concerts(concerts, file)
-    print("Færdig! Koncerterne er gemt")
+    file = io.StringIO()
+    dump_concerts(concerts, file)
+    if write_if_changed(Path(out_path), file.getvalue()):
+        print("Færdig! Koncerterne er gemt")
+    else:
+        print("Færdig! Koncerterne er uændrede")
+
+
+@metrics.stage("archive_concerts")
+def archive_concerts(concerts: list[Concert]):
+    """Gem koncerterne og ændringer i pris og udsolgt i arkivet."""
+    print("Gemmer i arkivet...")
+    conn = archive.open_archive()
+    try:
+        (added, changed) = archive.record(conn, concerts)
+    finally:
+        conn.close()
+    print(f"Færdig! {added} nye og {changed} ændrede koncerter i arkivet")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Lav siden med koncerter i Odense.")
+    parser.add_argument("--offline", action="store_true",
+                        help="brug kun gemte svar fra cachen (intet netværk)")
+    parser.add_argument("--strict", action="store_true",
+                        help="stop hvis en scraper fejler i stedet for at "
+                             "bruge dens koncerter fra sidste gang")
+    parser.add_argument("--image-retention-days", type=int,
+                        default=thumbnails.RETENTION_DAYS,
+                        help="behold ubrugte miniaturer i så mange dage")
+    parser.add_argument("--image-budget-mb", type=float,
+                        default=thumbnails.SIZE_BUDGET / 2**20,
+                        help="højeste samlede størrelse af miniaturerne")
+    return parser.parse_args()
 
 
 def main():
-    concerts = scrapers.all_concerts()
+    args = parse_args()
+    fetch.OFFLINE = args.offline
+    concerts = scrapers.all_concerts(strict=args.strict)
+    scrapers.parse_cache.save()
+    scrapers.parse_cache.print_stats()
+    print()
+    concerts = dedup.dedup(concerts)
     print()
     # Gemmer før thumbnails for at gemme de oprindelige URL'er til billederne.
     save_concerts("concerts.json", concerts)
     print()
-    make_thumbnails(concerts)
+    # Kun koncerter der er hentet nu, ikke gamle fra en scraper der fejlede
+    archive_concerts([c for c in concerts if c.url not in scrapers.stale_urls])
+    print()
+    thumbnails.make_thumbnails(concerts)
+    print()
+    with metrics.stage("collect_garbage"):
+        thumbnails.collect_garbage(concerts, args.image_retention_days,
+                                   int(args.image_budget_mb * 2**20))
     print()
     make_html("index.html", concerts)
+    print()
+    fetch.print_stats()
+    print(f"Slettede {fetch.prune_cache()} gamle svar fra cachen")
+    metrics.write_report(hosts=fetch.stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable
+
+import metrics
+from concert import Concert
+
+
+# Cache over events der allerede er parset. Nøglen er en hash af eventets
+# rå HTML/JSON, så kun nye eller ændrede events skal parses igen.
+
+
+# Skal ændres når parsningen ændres, så gamle resultater smides ud.
+VERSION = 1
+
+
+class ParseCache:
+    """Genbrug koncerter fra sidste kørsel når eventets rå data er uændret."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._old: dict[str, dict[str, dict | None]] | None = None
+        self._new: dict[str, dict[str, dict | None]] = defaultdict(dict)
+        self.hits: dict[str, int] = defaultdict(int)
+        self.misses: dict[str, int] = defaultdict(int)
+
+    def _load(self) -> dict[str, dict[str, dict | None]]:
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if data.get("version") != VERSION:
+            return {}
+        return data["venues"]
+
+    def parse(self, venue: str, raw: str | bytes,
+              parse: Callable[[], Concert | None]) -> Concert | None:
+        """Returner koncerten for eventet. Kalder kun parse ved ændringer.
+
+        parse må returnere None for events der skal springes over, det
+        bliver også husket. Fejl bliver ikke husket.
+        """
+        if isinstance(raw, str):
+            raw = raw.encode()
+        key = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            if self._old is None:
+                self._old = self._load()
+            venue_cache = self._old.get(venue, {})
+            hit = key in venue_cache
+            if hit:
+                cached = venue_cache[key]
+                self._new[venue][key] = cached
+                self.hits[venue] += 1
+        if hit:
+            metrics.add("parse_cache_hits")
+            return Concert.from_json(cached) if cached is not None else None
+        start = time.perf_counter()
+        concert = parse()
+        metrics.add("parsed")
+        metrics.add("parse_s", time.perf_counter() - start)
+        with self._lock:
+            self._new[venue][key] = concert.as_json() if concert else None
+            self.misses[venue] += 1
+        return concert
+
+    def save(self):
+        """Gem de events der blev set i denne kørsel.
+
+        Spillesteder der slet ikke blev parset (fx ved en fejl) beholder
+        deres gamle events.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with self._lock:
+            venues = (self._old or {}) | self._new
+            data = {"version": VERSION, "venues": venues}
+            with open(tmp, "w") as file:
+                json.dump(data, file)
+        os.replace(tmp, self.path)
+
+    def print_stats(self):
+        """Udskriv hvor mange events der blev genbrugt per spillested."""
+        print("Parse-cache (genbrugt/parset):")
+        for venue in sorted(self.hits.keys() | self.misses.keys()):
+            print(f"    {venue}: {self.hits[venue]}/{self.misses[venue]}")
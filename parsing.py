@@ -0,0 +1,46 @@
+import io
+from typing import Iterator
+
+from lxml import etree, html
+
+
+# Hjælpere til at parse direkte med lxml i stedet for BeautifulSoup.
+# "lxml" bygger et lxml-træ og bruger kompilerede XPath-udtryk, "stream"
+# gennemløber HTML'en med iterparse og tømmer hvert event efter brug.
+
+
+def has_class(cls: str) -> str:
+    """XPath-betingelse der svarer til CSS-selektoren .cls."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')"
+
+
+def tree(text: str) -> etree._Element:
+    """Parse et HTML-dokument eller -fragment til et lxml-træ."""
+    return html.document_fromstring(text)
+
+
+def iter_class(text: str, cls: str) -> Iterator[etree._Element]:
+    """Gennemløb elementer med klassen cls mens HTML'en parses.
+
+    Hvert element tømmes når det er brugt, så hele siden aldrig ligger i
+    hukommelsen på én gang. Elementet må derfor ikke gemmes.
+    """
+    source = io.BytesIO(text.encode())
+    events = etree.iterparse(source, events=("end",), html=True,
+                             encoding="utf-8")
+    for _, el in events:
+        if cls in (el.get("class") or "").split():
+            yield el
+            # Behold selve elementet så søskende stadig kan tælles
+            el.clear(keep_tail=True)
+
+
+def text(el: etree._Element) -> str:
+    """Al teksten i elementet (som .text i BeautifulSoup)."""
+    return "".join(el.itertext())
+
+
+def first(xpath: etree.XPath, el: etree._Element, **variables):
+    """Første resultat af XPath-udtrykket eller None."""
+    result = xpath(el, **variables)
+    return result[0] if result else None
@@ -1,13 +1,24 @@
+import asyncio
 import concurrent.futures
+import json
 import locale
+import os
 import re
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Any
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterable, TypeVar
 
-import requests
 from bs4 import BeautifulSoup, Tag
+from lxml import etree
 
+import dedup
+import fetch
+import metrics
+import parsing
+import tagging
 from concert import Concert, load_concerts
+from parsecache import ParseCache
 
 
 locale.setlocale(locale.LC_ALL, "da_DK.utf8")
@@ -17,6 +28,54 @@ re_srcset = re.compile(r"([^ ,]+)(?: (\d+)[wx])?")
 
 re_num = re.compile(r"\d+")
 
+# Events der er parset før genbruges hvis deres HTML/JSON er uændret.
+parse_cache = ParseCache(Path(".cache/parsed.json"))
+
+# Hvilken parser hver scraper bruger: "bs4" (BeautifulSoup), "lxml"
+# (XPath på et lxml-træ) eller "stream" (lxml iterparse). Scrapere der ikke
+# er nævnt bruger BeautifulSoup. Se bench.py for en sammenligning.
+PARSER = {
+    "Posten": "stream",
+    "Dexter": "stream",
+}
+
+
+# Alle scrapere: navn -> funktion der returnerer spillestedets koncerter.
+# Fyldes med @scraper og register, i den rækkefølge de står i filen.
+SCRAPERS: dict[str, Callable[[], list[Concert]]] = {}
+
+# Sekunder en scraper har til at hente alt, før den opgives og afbrydes.
+DEADLINE = 120
+# Spillesteder med en anden frist end DEADLINE
+DEADLINES: dict[str, float] = {}
+# Domænet i koncerternes URL'er for hver scraper der henter fra nettet (som i
+# dedup.SOURCE_PRIORITY). Scrapere uden domæne (Ekstralisten) henter ikke noget.
+HOSTS: dict[str, str] = {}
+# Ekstra tid til at scraperne opdager fristen og stopper
+GRACE = 10
+# Antal scrapere der kører på samme tid
+SCRAPER_THREADS = 8
+
+
+def register(name: str, fn: Callable[[], list[Concert]],
+             deadline: float | None = None, host: str | None = None):
+    """Tilføj en scraper (fx en spec) under navnet."""
+    if name in SCRAPERS:
+        raise ValueError(f"Scraper {name} is already registered")
+    SCRAPERS[name] = fn
+    if deadline is not None:
+        DEADLINES[name] = deadline
+    if host is not None:
+        HOSTS[name] = host
+
+
+def scraper(name: str, deadline: float | None = None, host: str | None = None):
+    """Dekorator der registrerer funktionen som scraper."""
+    def decorator(fn):
+        register(name, fn, deadline, host)
+        return fn
+    return decorator
+
 
 def best_from_srcset(srcset: str) -> str:
     """Returner URL til det bedste billede i srcset."""
@@ -34,6 +93,34 @@ def best_from_img(img: Tag) -> str:
     return best_from_srcset(img["srcset"])
 
 
+def best_from_img_el(img: etree._Element) -> str:
+    """Returner URL til det bedste billede fra <img> i et lxml-træ."""
+    assert img.tag == "img"
+    if img.get("srcset") is None:
+        return img.get("src")
+    return best_from_srcset(img.get("srcset"))
+
+
+T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+def side_index(items: Iterable[T], key: Callable[[T], K],
+               value: Callable[[T], V]) -> dict[K, V]:
+    """Lav et opslag fra key(item) til value(item).
+
+    Bruges til at slå data op fra en anden del af siden (fx søgetags) for
+    hvert kort i lineær tid. Ved dubletter bruges det første element.
+    """
+    index = {}
+    for item in items:
+        k = key(item)
+        if k not in index:
+            index[k] = value(item)
+    return index
+
+
 def get_price(s: str) -> int:
     """Udvinder prisen fra prisskilt fx fra "1.295,00 kr"."""
     s = s.lower()
@@ -46,36 +133,68 @@ def get_price(s: str) -> int:
     return int(price_match.group())
 
 
-def storms() -> list[Concert]:
-    """Hent koncerter fra storms pakhus."""
-    r = requests.get("https://stormspakhus.dk/events/")
-    soup = BeautifulSoup(r.text, features="lxml")
-    events = soup.find_all(class_="fl-post-feed-post")
-    concerts = []
-    current_year = datetime.today().year
-    for event in events:
-        title = event.find(class_="fl-post-feed-title").a["title"]
-        if "koncert" not in title.lower():
-            continue
-        title = title.removesuffix(" // Gratis Koncert")
-        date_str = event.find(
-            class_="fl-post-grid-event-calendar-date").span.string
-        # Året tilføjes til datoen så den kan parses korrekt.
-        date = datetime.strptime(f"{current_year};{date_str}",
-                                 "%Y;%B %d @ %H:%M")
-        venue = "Storms Pakhus"
-        price = 0
-        sold_out = False
-        img_url = best_from_img(event.find(class_="fl-post-feed-image").a.img)
-        url = event.find(class_="fl-post-feed-title").a["href"]
-        concert = Concert(title, venue, date, price, sold_out, img_url, url)
-        concerts.append(concert)
-    return concerts
+@dataclass
+class PageSpec:
+    """Scraper for en side hvor hvert event er et element.
+
+    events er en CSS-selektor for eventene. fields har en funktion per felt
+    i Concert, der finder feltet i eventets element. Felter der ikke er en
+    funktion er ens for alle events. Events hvor keep(event) er falsk
+    springes over.
+    """
+    url: str
+    events: str
+    fields: dict[str, Any]
+    keep: Callable[[Tag], bool] | None = None
+    # Sæt hvis siden ikke selv siger hvilken tegnkodning den har
+    encoding: str | None = None
+
+    def __call__(self) -> list[Concert]:
+        r = fetch.get(self.url)
+        if self.encoding is not None:
+            r.encoding = self.encoding
+        soup = BeautifulSoup(r.text, features="lxml")
+        concerts = []
+        for event in soup.select(self.events):
+            if self.keep is not None and not self.keep(event):
+                continue
+            values = {name: field(event) if callable(field) else field
+                      for (name, field) in self.fields.items()}
+            concerts.append(Concert(**values))
+        return concerts
+
+
+def storms_title(event: Tag) -> str:
+    return event.select_one(".fl-post-feed-title").a["title"]
+
+
+def storms_date(event: Tag) -> datetime:
+    date_str = event.select_one(".fl-post-grid-event-calendar-date").span.string
+    # Året tilføjes til datoen så den kan parses korrekt.
+    return datetime.strptime(f"{datetime.today().year};{date_str}",
+                             "%Y;%B %d @ %H:%M")
+
+
+register("Storms", PageSpec(
+    url="https://stormspakhus.dk/events/",
+    events=".fl-post-feed-post",
+    keep=lambda event: "koncert" in storms_title(event).lower(),
+    fields={
+        "title": lambda event: storms_title(event).removesuffix(" // Gratis Koncert"),
+        "venue": "Storms Pakhus",
+        "date": storms_date,
+        "price": 0,
+        "sold_out": False,
+        "img_url": lambda event: best_from_img(
+            event.select_one(".fl-post-feed-image").a.img),
+        "url": lambda event: event.select_one(".fl-post-feed-title").a["href"],
+    },
+), host="stormspakhus.dk")
 
 
 def pd_fetch_page(url: str, page_no: int) -> dict[Any, Any]:
     """Hent en enkelt "side" fra posten eller dexter."""
-    r = requests.post(
+    r = fetch.post(
         f"https://{url}/wp-admin/admin-ajax.php",
         headers={"Content-Type": "application/x-www-form-urlencoded"},
         data=f"action=nkt_event_pagination&page={page_no}&posts_per_page=27&view=box")
@@ -86,70 +205,112 @@ def pd_fetch_pages(url: str) -> list[str]:
     """Hent alle "sider" fra posten eller dexter."""
     first_page = pd_fetch_page(url, 1)
     page_count = first_page["data"]["total_pages"]
+    # Hent de andre sider samtidigt
+    other_pages = fetch.map_concurrent(lambda i: pd_fetch_page(url, i),
+                                       range(2, page_count+1))
     pages = [first_page["data"]["html"]]
-    # Hent de andre sider
-    for i in range(2, page_count+1):
-        page = pd_fetch_page(url, i)
-        page_html = page["data"]["html"]
-        pages.append(page_html)
+    pages.extend(page["data"]["html"] for page in other_pages)
     return pages
 
 
-def posten() -> list[Concert]:
-    """Hent alle koncerter fra posten."""
-    pages = pd_fetch_pages("postenlive.dk")
-    # Hiv koncerterne ud
-    events = []
-    for page in pages:
-        soup = BeautifulSoup(page, features="lxml")
-        page_events = soup.select(".event-box")
-        events.extend(page_events)
-    concerts = []
-    for event in events:
-        goop = event.select_one("div > div > div")
-        title = goop.select_one(".bde-heading").string.strip()
-        date_str = goop.select_one("div div:nth-of-type(3) div").string.strip()
-        date = datetime.strptime(date_str, "%d. %B %Y")
-        venue = "Posten"
-        price_tag = goop.select_one("div div:nth-of-type(4) span").string
-        price = get_price(price_tag)
-        sold_out = "udsolgt" in price_tag.lower()
-        img_url = best_from_img(event.find(class_="breakdance-image-object"))
-        url = event.div.a["href"]
-        concert = Concert(title, venue, date, price, sold_out, img_url, url)
-        concerts.append(concert)
-    return concerts
+@dataclass
+class PdSpec:
+    """Scraper for Posten og Dexter, som bruger samme WordPress-tema.
 
+    Kun domænet og hvilken div datoen og prisen står i er forskellige.
+    """
+    venue: str
+    domain: str
+    date_no: int
+    price_no: int
 
-def dexter() -> list[Concert]:
-    """Hent alle koncerter fra dexter."""
-    pages = pd_fetch_pages("dexter.dk")
-    # Hiv koncerterne ud
-    events = []
-    for page in pages:
-        soup = BeautifulSoup(page, features="lxml")
-        page_events = soup.select(".event-box")
-        events.extend(page_events)
+    def __call__(self) -> list[Concert]:
+        pages = pd_fetch_pages(self.domain)
+        return pd_parse(pages, self.venue, self.date_no, self.price_no)
+
+
+register("Posten", PdSpec("Posten", "postenlive.dk", date_no=3, price_no=4),
+         host="postenlive.dk")
+register("Dexter", PdSpec("Dexter", "dexter.dk", date_no=2, price_no=3),
+         host="dexter.dk")
+
+
+def pd_parse(pages: list[str], venue: str, date_no: int, price_no: int,
+             parser: str | None = None) -> list[Concert]:
+    """Hiv koncerterne ud af siderne fra posten eller dexter.
+
+    Siderne er ens bortset fra hvilken div datoen og prisen står i.
+    """
+    parser = parser or PARSER.get(venue, "bs4")
     concerts = []
-    for event in events:
-        goop = event.select_one("div > div > div")
-        title = goop.select_one(".bde-heading").string.strip()
-        date_str = goop.select_one("div div:nth-of-type(2) div").string.strip()
-        date = datetime.strptime(date_str, "%d. %B %Y")
-        venue = "Dexter"
-        price_tag = goop.select_one("div div:nth-of-type(3) span").string
-        price = get_price(price_tag)
-        sold_out = "udsolgt" in price_tag.lower()
-        img_url = best_from_img(event.find(class_="breakdance-image-object"))
-        url = event.div.a["href"]
-        concert = Concert(title, venue, date, price, sold_out, img_url, url)
-        concerts.append(concert)
+    for page in pages:
+        if parser == "bs4":
+            soup = BeautifulSoup(page, features="lxml")
+            for event in soup.select(".event-box"):
+                concert = parse_cache.parse(
+                    venue, str(event),
+                    lambda: pd_event(event, venue, date_no, price_no))
+                concerts.append(concert)
+        else:
+            if parser == "stream":
+                events = parsing.iter_class(page, "event-box")
+            else:
+                events = xp_pd_events(parsing.tree(page))
+            for event in events:
+                concert = parse_cache.parse(
+                    venue, etree.tostring(event),
+                    lambda: pd_event_el(event, venue, date_no, price_no))
+                concerts.append(concert)
     return concerts
 
 
+def pd_event(event: Tag, venue: str, date_no: int, price_no: int) -> Concert:
+    """Parse et enkelt event fra posten eller dexter med BeautifulSoup."""
+    goop = event.select_one("div > div > div")
+    title = goop.select_one(".bde-heading").string.strip()
+    date_str = goop.select_one(f"div div:nth-of-type({date_no}) div").string.strip()
+    date = datetime.strptime(date_str, "%d. %B %Y")
+    price_tag = goop.select_one(f"div div:nth-of-type({price_no}) span").string
+    price = get_price(price_tag)
+    sold_out = "udsolgt" in price_tag.lower()
+    img_url = best_from_img(event.find(class_="breakdance-image-object"))
+    url = event.div.a["href"]
+    return Concert(title, venue, date, price, sold_out, img_url, url)
+
+
+# Samme selektorer som i pd_event men som XPath
+xp_pd_events = etree.XPath(f"//*[{parsing.has_class('event-box')}]")
+xp_pd_goop = etree.XPath(".//div[parent::div/parent::div]")
+xp_pd_title = etree.XPath(f".//*[{parsing.has_class('bde-heading')}]")
+xp_pd_nth = etree.XPath(
+    "(.//*[local-name() = $tag]"
+    "[ancestor::div[count(preceding-sibling::div) = $n - 1][ancestor::div]])[1]")
+xp_pd_img = etree.XPath(f".//*[{parsing.has_class('breakdance-image-object')}]")
+# Almindelige strenge: lxml's "smarte" strenge peger tilbage på elementet og
+# holder dermed hele sidens træ i live så længe koncerten findes.
+xp_pd_url = etree.XPath("((.//div)[1]//a)[1]/@href", smart_strings=False)
+
+
+def pd_event_el(event: etree._Element, venue: str, date_no: int,
+                price_no: int) -> Concert:
+    """Parse et enkelt event fra posten eller dexter med lxml."""
+    goop = parsing.first(xp_pd_goop, event)
+    title = parsing.text(parsing.first(xp_pd_title, goop)).strip()
+    date_el = parsing.first(xp_pd_nth, goop, tag="div", n=date_no)
+    date_str = parsing.text(date_el).strip()
+    date = datetime.strptime(date_str, "%d. %B %Y")
+    price_tag = parsing.text(parsing.first(xp_pd_nth, goop, tag="span", n=price_no))
+    price = get_price(price_tag)
+    sold_out = "udsolgt" in price_tag.lower()
+    img_url = best_from_img_el(parsing.first(xp_pd_img, event))
+    url = parsing.first(xp_pd_url, event)
+    return Concert(title, venue, date, price, sold_out, img_url, url)
+
+
+@scraper("Kulturmaskinen", host="kulturmaskinen.dk")
 def kulturmaskinen() -> list[Concert]:
     """Hent alle koncerter fra kulturmaskinen."""
-    r = requests.get(
+    r = fetch.get(
         "https://api.uheadless.com/api"
         "?token=6dc733b1-53a0-4c6a-b469-8ae912316dc4&depth=6&lang=en-us"
         "&postdata=JTdCJTIybGltaXQlMjIlM0E5OTk5OSUyQyUyMnF1ZXJ5JTIyJTNB"
@@ -181,53 +342,67 @@ def kulturmaskinen() -> list[Concert]:
     return concerts
 
 
+@scraper("Live Culture", host="liveculture.dk")
 def liveculture() -> list[Concert]:
     """Hent koncerter fra Live Culture (undtaget Magasinet og Odeon)."""
-    r = requests.get("https://liveculture.dk/")
+    r = fetch.get("https://liveculture.dk/")
     soup = BeautifulSoup(r.text, features="lxml")
-    search_items = soup.select(".searchItem")
+    # Søgetags står i en separat del af siden, find dem per titel
+    tags_by_title = side_index(
+        soup.select(".searchItem"),
+        lambda si: si.div.div.string.strip(),
+        lambda si: {tag.string for tag in si.select(".searchTag")})
     events = soup.select(".card")
     concerts = []
     for event in events:
-        title = event.select_one(".singleBoxTitle").span.string
-        # Fjern "gavekort" eventen
-        if title == "Gavekort":
-            continue
         try:
-            date_str = event.select_one(".heroLabels__single--date").string
-            first_date = date_str.split(" - ")[0]
-            date = datetime.strptime(first_date, "%d.%m.%y")
-            venue = event.select_one(".heroLabels__single--venue").string
-            # Fjern koncerter fra magasinet; de bliver også hentet fra kulturmaskinen.
-            if venue == "Magasinet":
-                continue
-            # Koncerter fra Odeon hentes seperat.
-            if venue == "ODEON":
+            concert = parse_cache.parse("Live Culture", str(event),
+                                        lambda: liveculture_event(event))
+            if concert is None:
                 continue
-            price_tag = event.select(".ticketButton__time")[0].string
-            # Nogle koncerter skal man vælge tidspunkt. Der er prisen et andet sted.
-            if ":" in price_tag:
-                price_tag = event.select_one(".boxtitle__pricing__amount").string
-            price = get_price(price_tag)
-            status = event.select_one(".heroLabels__single--status")
-            sold_out = "udsolgt" in status.text.lower() if status else False
-            img_url = best_from_srcset(event.select_one("a > .cover")["data-srcset"])
-            url = event.a["href"]
-            concert = Concert(title, venue, date, price, sold_out, img_url, url)
-            # Undersøg om det er comedy (alt andet er koncerter)
-            si = next(si for si in search_items if si.div.div.string.strip() == title)
-            comedy = any("Comedy" == tag.string for tag in si.select(".searchTag"))
-            if not comedy:
-                concerts.append(concert)
+            # Marker comedy (alt andet er koncerter), se tagging.BLACKLIST
+            if "Comedy" in tags_by_title.get(concert.title, set()):
+                concert.tags.append("comedy")
+            concerts.append(concert)
         except Exception as e:
+            title = event.select_one(".singleBoxTitle").span.string
             print(f"Fejl fra Live Culture ved event med navn: {title}")
             print("   ", e)
     return concerts
 
 
+def liveculture_event(event: Tag) -> Concert | None:
+    """Parse et enkelt event fra Live Culture. None hvis det skal springes over."""
+    title = event.select_one(".singleBoxTitle").span.string
+    # Fjern "gavekort" eventen
+    if title == "Gavekort":
+        return None
+    date_str = event.select_one(".heroLabels__single--date").string
+    first_date = date_str.split(" - ")[0]
+    date = datetime.strptime(first_date, "%d.%m.%y")
+    venue = event.select_one(".heroLabels__single--venue").string
+    # Fjern koncerter fra magasinet; de bliver også hentet fra kulturmaskinen.
+    if venue == "Magasinet":
+        return None
+    # Koncerter fra Odeon hentes seperat.
+    if venue == "ODEON":
+        return None
+    price_tag = event.select(".ticketButton__time")[0].string
+    # Nogle koncerter skal man vælge tidspunkt. Der er prisen et andet sted.
+    if ":" in price_tag:
+        price_tag = event.select_one(".boxtitle__pricing__amount").string
+    price = get_price(price_tag)
+    status = event.select_one(".heroLabels__single--status")
+    sold_out = "udsolgt" in status.text.lower() if status else False
+    img_url = best_from_srcset(event.select_one("a > .cover")["data-srcset"])
+    url = event.a["href"]
+    return Concert(title, venue, date, price, sold_out, img_url, url)
+
+
+@scraper("Odeon", host="odeonodense.dk")
 def odeon() -> list[Concert]:
     """Hent alle koncerter fra Odeon."""
-    r = requests.get("https://odeonodense.dk/kalender")
+    r = fetch.get("https://odeonodense.dk/kalender")
     soup = BeautifulSoup(r.text, features="lxml")
     # Her vælger jeg allerede kun koncerter.
     events = soup.find_all("a", {"data-js-filter-item": re.compile(r"koncert")})
@@ -240,70 +415,87 @@ def odeon() -> list[Concert]:
         sold_out = "udsolgt" in event.select(".text-link")[0].string.lower()
         img_url = "https://odeonodense.dk" + best_from_srcset(event.source["data-srcset"])
         url = "https://odeonodense.dk" + event["href"]
-        # Hent koncertsiden for at finde prisen
-        pr = requests.get(url)
-        psoup = BeautifulSoup(pr.text, features="lxml")
-        price = get_price(next(psoup.select_one(".mt-8").strings))
-        concert = Concert(title, venue, date, price, sold_out, img_url, url)
+        # Prisen findes senere fra koncertsiden
+        concert = Concert(title, venue, date, None, sold_out, img_url, url)
         concerts.append(concert)
+    # Hent koncertsiderne samtidigt for at finde priserne
+    prices = fetch.map_concurrent(odeon_price, [c.url for c in concerts])
+    for concert, price in zip(concerts, prices):
+        concert.price = price
     return concerts
 
 
+# Koncertsiderne hos Odeon bruges kun til prisen, som sjældent ændres, og
+# de har ikke ETag/Last-Modified. Kalenderen hentes derimod hver gang.
+ODEON_PRICE_TTL = 3 * 24 * 3600
+
+
+def odeon_price(url: str) -> int:
+    """Hent prisen fra en koncertside hos Odeon."""
+    r = fetch.get(url, ttl=ODEON_PRICE_TTL)
+    soup = BeautifulSoup(r.text, features="lxml")
+    return get_price(next(soup.select_one(".mt-8").strings))
+
+
+@scraper("Grand Hotel", host="grandodense.dk")
 def grandhotel() -> list[Concert]:
     """Hent alle koncerter fra Grand Hotel."""
-    r = requests.get("https://www.grandodense.dk/event-koncert/")
+    r = fetch.get("https://www.grandodense.dk/event-koncert/")
     r.encoding = "utf-8"
     soup = BeautifulSoup(r.text, features="lxml")
     events = soup.select(".Preview_block__16Zmu .Preview_block__16Zmu")
     concerts = []
-    re_date = re.compile(r"(\d+. \w+ \d+)")
-    re_price = re.compile(r"\d+,-")
-    re_sold_out = re.compile(r"udsolgt", re.IGNORECASE)
     for event in events:
         try:
-            # Fjern begivenheder fra resturanten
-            link = event.select_one("a[href]")["href"]
-            if not link.startswith("/event-koncert/"):
-                continue
-        except Exception as e:
-            print(f"Fejl fra Grand Odense ved event før link")
-            print("   ", e)
-        try:
-            title = event.h2.string
-            date_str = event.find(string=re_date).string
-            # Tag kun (første) datoen ignorer alt andet
-            date_str = re_date.search(date_str)[0]
-            date = datetime.strptime(date_str, "%d. %B %Y")
-            venue = "Grand Hotel"
-            price = get_price(event.find(string=re_price))
-            sold_out = event.find(string=re_sold_out) is not None
-            img_url = best_from_img(event.img)
-            url = "https://grandodense.dk" + link
-            concert = Concert(title, venue, date, price, sold_out, img_url, url)
-            concerts.append(concert)
+            concert = parse_cache.parse("Grand Hotel", str(event),
+                                        lambda: grandhotel_event(event))
+            if concert is not None:
+                concerts.append(concert)
         except Exception as e:
-            print(f"Fejl fra Grand Odense ved event med link: {link}")
+            link = event.select_one("a[href]")
+            print(f"Fejl fra Grand Odense ved event med link: "
+                  f"{link['href'] if link else None}")
             print("   ", e)
     return concerts
 
 
+re_gh_date = re.compile(r"(\d+. \w+ \d+)")
+re_gh_price = re.compile(r"\d+,-")
+re_gh_sold_out = re.compile(r"udsolgt", re.IGNORECASE)
+
+
+def grandhotel_event(event: Tag) -> Concert | None:
+    """Parse et enkelt event fra Grand Hotel. None hvis det ikke er en koncert."""
+    # Fjern begivenheder fra resturanten
+    link = event.select_one("a[href]")["href"]
+    if not link.startswith("/event-koncert/"):
+        return None
+    title = event.h2.string
+    date_str = event.find(string=re_gh_date).string
+    # Tag kun (første) datoen ignorer alt andet
+    date_str = re_gh_date.search(date_str)[0]
+    date = datetime.strptime(date_str, "%d. %B %Y")
+    venue = "Grand Hotel"
+    price = get_price(event.find(string=re_gh_price))
+    sold_out = event.find(string=re_gh_sold_out) is not None
+    img_url = best_from_img(event.img)
+    url = "https://grandodense.dk" + link
+    return Concert(title, venue, date, price, sold_out, img_url, url)
+
+
+@scraper("TCB Underground", host="tcbunderground.com")
 def tcbunderground() -> list[Concert]:
     """Hent alle koncerter fra TCB Underground."""
-    r = requests.get("https://tcbunderground.com/arrangementer")
+    r = fetch.get("https://tcbunderground.com/arrangementer")
     r.encoding = "utf-8"
     soup = BeautifulSoup(r.text, features="lxml")
     events = soup.select("tbody tr")
+    # Prisen og billedet er kun på billetsiden
+    # Billetsiden kræver dog JS så jeg henter dataen direkte (samtidigt)
+    urls = [event.a["href"] for event in events]
+    infos = fetch.map_concurrent(tcbunderground_info, urls)
     concerts = []
-    for event in events:
-        # Prisen og billedet er kun på billetsiden
-        # Billetsiden kræver dog JS så jeg henter dataen direkte
-        url = event.a["href"]
-        name = url.split("/")[-2]
-        info_url = f"https://checkoutapi.ticketbutler.io/api/events/title/{name}/"
-        headers = {"Origin": "https://tcbunderground.ticketbutler.io",
-                   "Referer": "https://tcbunderground.ticketbutler.io/"}
-        er = requests.get(info_url, headers=headers)
-        info = er.json()
+    for url, info in zip(urls, infos):
         title = info["title"]
         venue = "TCB Underground"
         date_str = info["start_date"]
@@ -316,29 +508,39 @@ def tcbunderground() -> list[Concert]:
     return concerts
 
 
-def vaerket() -> list[Concert]:
-    """Hent alle koncerter fra Odense Værket."""
-    r = requests.get("https://odensevaerket.dk/kultur-musikhus/")
-    r.encoding = "utf-8"
-    soup = BeautifulSoup(r.text, features="lxml")
-    events = soup.select(".products > li")
-    concerts = []
-    current_year = datetime.today().year
-    for event in events:
-        title = event.h2.string.split(" – ", 1)[1]
-        date_str = event.h2.string.split(" – ")[0]
-        date_str = re.sub(r"-\d+", ".", date_str)
-        date = datetime.strptime(f"{date_str};{current_year}", "%d. %B;%Y")
-        venue = "Odense Værket"
-        price = get_price(event.select_one(".price").text)
-        sold_out = event.select_one(".berocket_better_labels") is not None
-        img_url = best_from_img(event.img)
-        url = event.select_one(".woocommerce-LoopProduct-link")["href"]
-        concert = Concert(title, venue, date, price, sold_out, img_url, url)
-        concerts.append(concert)
-    return concerts
+def tcbunderground_info(url: str) -> dict[str, Any]:
+    """Hent info om en koncert fra TCB Undergrounds billetsystem."""
+    name = url.split("/")[-2]
+    info_url = f"https://checkoutapi.ticketbutler.io/api/events/title/{name}/"
+    headers = {"Origin": "https://tcbunderground.ticketbutler.io",
+               "Referer": "https://tcbunderground.ticketbutler.io/"}
+    r = fetch.get(info_url, headers=headers)
+    return r.json()
+
 
+def vaerket_date(event: Tag) -> datetime:
+    date_str = event.h2.string.split(" – ")[0]
+    date_str = re.sub(r"-\d+", ".", date_str)
+    return datetime.strptime(f"{date_str};{datetime.today().year}", "%d. %B;%Y")
 
+
+register("Odense Værket", PageSpec(
+    url="https://odensevaerket.dk/kultur-musikhus/",
+    events=".products > li",
+    encoding="utf-8",
+    fields={
+        "title": lambda event: event.h2.string.split(" – ", 1)[1],
+        "venue": "Odense Værket",
+        "date": vaerket_date,
+        "price": lambda event: get_price(event.select_one(".price").text),
+        "sold_out": lambda event: event.select_one(".berocket_better_labels") is not None,
+        "img_url": lambda event: best_from_img(event.img),
+        "url": lambda event: event.select_one(".woocommerce-LoopProduct-link")["href"],
+    },
+), host="odensevaerket.dk")
+
+
+@scraper("Studenterhuset", host="yourticket.dk")
 def studenterhuset() -> list[Concert]:
     """Hent alle koncerter fra Studenterhus Odense."""
     # Vælg rigtig arrangør og kun musik
@@ -347,8 +549,8 @@ def studenterhuset() -> list[Concert]:
     # Man SKAL have de rigtige headers eller vil den ikke gøre noget...
     headers = {"origin": "https://www.yourticket.dk", "referer": "https://www.yourtickets.dk",
                "key": "3-9D8DC9C1-576A-4727-890C-5F140E4D03F5"}
-    r = requests.post("https://publicapi.yourticket.dk/Events/GetEventsForOverview",
-                      headers=headers, json=data)
+    r = fetch.post("https://publicapi.yourticket.dk/Events/GetEventsForOverview",
+                   headers=headers, json=data)
     concerts = []
     for event in r.json():
         title = event["Name"].removesuffix(" // Studenterhus Odense")
@@ -365,6 +567,7 @@ def studenterhuset() -> list[Concert]:
     return concerts
 
 
+@scraper("Ekstralisten")
 def extra() -> list[Concert]:
     """Indlæser de ekstra manuelt indstastede koncerter."""
     try:
@@ -378,39 +581,146 @@ def extra() -> list[Concert]:
         return []
 
 
-def all_concerts() -> list[Concert]:
-    """Hent alle koncerterne og returner i kronologisk rækkefølge."""
-    scrapers = [
-        ("Storms", storms),
-        ("Posten", posten),
-        ("Dexter", dexter),
-        ("Kulturmaskinen", kulturmaskinen),
-        ("Live Culture", liveculture),
-        ("Odeon", odeon),
-        ("Grand Hotel", grandhotel),
-        ("TCB Underground", tcbunderground),
-        ("Odense Værket", vaerket),
-        ("Studenterhuset", studenterhuset),
-        ("Ekstralisten", extra),
-    ]
+# Hver scrapers koncerter fra sidste gang den virkede. Bruges hvis den fejler.
+LAST_GOOD_PATH = Path(".cache/last-good.json")
+# URL'erne på de koncerter fra sidste gang som all_concerts brugte i denne
+# kørsel. De er ikke hentet nu og gemmes derfor ikke i arkivet.
+stale_urls: set[str] = set()
+# Sidste kørsels resultat. Bruges for scrapere der ikke er i LAST_GOOD_PATH
+# (fx med en tom cache).
+CONCERTS_PATH = Path("concerts.json")
+
+
+def load_last_good() -> dict[str, list[Concert]]:
+    try:
+        with open(LAST_GOOD_PATH, "r") as file:
+            data = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {name: [Concert.from_json(c) for c in concerts]
+            for (name, concerts) in data.items()}
+
+
+def load_published() -> dict[str, list[Concert]]:
+    """Koncerterne i CONCERTS_PATH fordelt på scrapere efter URL'ens domæne."""
+    try:
+        with open(CONCERTS_PATH, "r") as file:
+            concerts = load_concerts(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    names = {host: name for (name, host) in HOSTS.items()}
+    published: dict[str, list[Concert]] = {}
+    for concert in concerts:
+        name = names.get(dedup.source(concert))
+        if name is not None:
+            published.setdefault(name, []).append(concert)
+    return published
+
+
+def save_last_good(last_good: dict[str, list[Concert]]):
+    LAST_GOOD_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = LAST_GOOD_PATH.with_suffix(".tmp")
+    with open(tmp, "w") as file:
+        json.dump({name: [c.as_json() for c in concerts]
+                   for (name, concerts) in last_good.items()}, file)
+    os.replace(tmp, LAST_GOOD_PATH)
+
+
+def run_scraper(name: str, scraper: Callable[[], list[Concert]],
+                deadline: fetch.Deadline) -> tuple[list[Concert], metrics.Stage]:
+    """Kør scraperen med fristen og som sit eget trin i målingerne."""
+    with (metrics.stage(name, thread=True) as stage, fetch.deadline(deadline)):
+        concerts = scraper()
+        metrics.add("events", len(concerts))
+    return (concerts, stage)
+
+
+async def scrape(name: str, executor: concurrent.futures.Executor) -> list[Concert]:
+    """Kør en scraper i executor og vent højst dens frist."""
+    loop = asyncio.get_running_loop()
+    started = asyncio.Event()
+    deadline = fetch.Deadline(DEADLINES.get(name, DEADLINE))
+
+    def run():
+        # Fristen tæller først fra scraperen får en tråd
+        deadline.start()
+        loop.call_soon_threadsafe(started.set)
+        return run_scraper(name, SCRAPERS[name], deadline)
+
+    future = loop.run_in_executor(executor, metrics.propagate(run))
+    await started.wait()
+    try:
+        (concerts, stage) = await asyncio.wait_for(future, deadline.seconds + GRACE)
+    except TimeoutError:
+        # Scraperen stopper ved sin næste forespørgsel
+        deadline.cancel()
+        print("...", name, "fejlede: blev ikke færdig i tide")
+        raise fetch.DeadlineExceeded(f"{name} did not finish in {deadline.seconds} s")
+    except Exception as e:
+        print("...", name, f"fejlede: {e!r}")
+        raise
+    print("...", name, f"hentet ({stage.wall_s:.1f} s)")
+    return concerts
+
+
+async def scrape_all() -> tuple[dict[str, list[Concert]], dict[str, Exception]]:
+    """Kør alle scraperne samtidig. Returner (koncerter, fejl) per scraper."""
+    # Højst SCRAPER_THREADS scrapere kører på en gang, uanset hvor mange der er
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=SCRAPER_THREADS)
+    try:
+        names = list(SCRAPERS)
+        outcomes = await asyncio.gather(*(scrape(name, executor) for name in names),
+                                        return_exceptions=True)
+    finally:
+        # Vent ikke på scrapere der hænger
+        executor.shutdown(wait=False, cancel_futures=True)
+    results = {}
+    failures = {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, Exception):
+            outcome.add_note(f"Error in {name}")
+            failures[name] = outcome
+        else:
+            results[name] = outcome
+    return (results, failures)
+
+
+@metrics.stage("all_concerts")
+def all_concerts(strict: bool = False) -> list[Concert]:
+    """Hent alle koncerterne og returner i kronologisk rækkefølge.
+
+    Hvis en scraper fejler eller ikke bliver færdig inden sin frist, bruges
+    dens koncerter fra sidste gang den virkede, så siden stadig kan laves.
+    Har den aldrig virket, bruges dens koncerter fra CONCERTS_PATH.
+    Med strict=True fejler det hele i stedet (som ExceptionGroup). Det gør
+    det også hvis ingen af scraperne der henter fra nettet virkede, så en
+    kørsel uden net ikke overskriver siden med de gamle koncerter alene.
+    """
     print("Henter koncerter")
+    last_good = load_published() | load_last_good()
+    (results, failures) = asyncio.run(scrape_all())
+    if failures and strict:
+        raise ExceptionGroup("Errors while getting concerts", list(failures.values()))
+    if not any(name in results for name in HOSTS):
+        raise ExceptionGroup("No scraper could get concerts", list(failures.values()))
+    for name, e in failures.items():
+        metrics.error(f"{name}: {e!r}")
+    save_last_good(last_good | results)
+    now = datetime.now()
     concerts = []
-    exceptions = []
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_site = {executor.submit(scraper): name
-                          for (name, scraper) in scrapers}
-        for future in concurrent.futures.as_completed(future_to_site):
-            name = future_to_site[future]
-            try:
-                concerts.extend(future.result())
-                print("...", name, "hentet")
-            except Exception as e:
-                e.add_note(f"Error in {name}")
-                exceptions.append(e)
-                print("...", name, "fejlede")
-    if exceptions:
-        raise ExceptionGroup("Errors while getting concerts", exceptions)
+    stale_urls.clear()
+    for name in SCRAPERS:
+        if name in results:
+            concerts.extend(results[name])
+        else:
+            stale = [c for c in last_good.get(name, []) if c.date >= now]
+            concerts.extend(stale)
+            stale_urls.update(c.url for c in stale)
+            print(f"WARN: using {len(stale)} concerts from the last good run of {name}")
     print(f"Alle koncerter er hentet ({len(concerts)})")
+    for concert in concerts:
+        tagging.tag(concert)
+    concerts = [c for c in concerts if not tagging.is_blacklisted(c)]
     concerts.sort(key=lambda c: (c.date, c.venue, c.title))
     today = datetime.now().date()
     for c in concerts:
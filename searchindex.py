@@ -0,0 +1,67 @@
+import unicodedata
+from datetime import date
+
+from concert import Concert
+
+
+# Søgeindekset som filters.js bruger, så browseren ikke skal læse og
+# klassificere alle koncerterne i DOM'en ved hvert tastetryk.
+#
+# Indekset er i kolonner: titlerne (normaliseret), datoerne som dage siden
+# 1970, månedernes nummer i "months", tags som bits i "flags" og et
+# trigram-indeks fra tre tegn til koncerterne hvis titel indeholder dem.
+
+
+# Bits i "flags" for koncerternes tags (se tagging.py). Skal passe med filters.js.
+FLAGS = {
+    "quiz": 1,
+    "jam": 2,
+    "jazzfest": 4,
+    "nashville": 8,
+}
+
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+def normalize(title: str) -> str:
+    """Titlen som der søges i (filters.js normaliserer søgningen ens)."""
+    return unicodedata.normalize("NFC", title).lower()
+
+
+def flags(concert: Concert) -> int:
+    """Koncertens tags som bits."""
+    result = 0
+    for tag in concert.tags:
+        result |= FLAGS.get(tag, 0)
+    return result
+
+
+def trigrams(s: str) -> set[str]:
+    return {s[i:i+3] for i in range(len(s) - 2)}
+
+
+def build_index(concerts: list[Concert]) -> dict:
+    """Byg søgeindekset. Koncerternes id er deres plads i listen."""
+    titles = [normalize(c.title) for c in concerts]
+    # Koncerterne er sorteret, så hver måned er samlet
+    months = [c.date.strftime("%Y-%m") for c in concerts]
+    month_keys = sorted(set(months))
+    month_no = {key: i for (i, key) in enumerate(month_keys)}
+    start: dict[str, int] = {}
+    for i, key in enumerate(months):
+        start.setdefault(key, i)
+    grams: dict[str, list[int]] = {}
+    for i, title in enumerate(titles):
+        for gram in trigrams(title):
+            grams.setdefault(gram, []).append(i)
+    return {
+        "months": month_keys,
+        "titles": titles,
+        "days": [c.date.toordinal() - EPOCH for c in concerts],
+        # Hvor hver måned starter. Kortene på siden har deres plads i måneden.
+        "start": [start[key] for key in month_keys],
+        "month": [month_no[key] for key in months],
+        "flags": [flags(c) for c in concerts],
+        # Sorteret så indekset er ens fra kørsel til kørsel
+        "trigrams": dict(sorted(grams.items())),
+    }
@@ -0,0 +1,79 @@
+import re
+
+from concert import Concert
+from searchindex import normalize
+
+
+# Regelbaseret klassificering af koncerterne (quiz, jamsession, ...).
+# Reglerne samles til ét regulært udtryk som køres én gang per titel, og
+# taggene gemmes på koncerten (og i concerts.json), så siden ikke selv skal
+# klassificere.
+
+
+# (tag, regulært udtryk) der søges efter i den normaliserede titel.
+RULES = [
+    # I hope no band name includes "quiz"...
+    ("quiz", r"quiz"),
+    ("jam", r"jazz jam"),
+    ("jam", r"dexter jam"),
+    ("jam", r"blue monday blues jam"),
+    ("jam", r"jamsession v\..* // odense jazz festival"),
+    ("jam", r"jam night.*nashville nights 2026"),
+    ("jazzfest", r"// odense jazz festival"),
+    ("nashville", r"nashville nights"),
+]
+
+# Titler der skal have et tag men ikke kan findes med en regel.
+TITLES = {
+    "jazzfest": [
+        "fini sings with strings",
+        "carl winther trio feat. randy brecker",
+        "viktoria søndergaard music of secrets",
+        "elements  of  refusal",
+        "tribute to thilo",
+        "øjne & ører: ki!",
+        "giacomo smith ? joe webb ? snorre kirk ? anders fjelds",
+    ],
+}
+
+# Koncerter med disse tags er ikke koncerter og kommer ikke på siden.
+BLACKLIST = {"comedy"}
+
+
+def compile_rules(rules: list[tuple[str, str]],
+                  titles: dict[str, list[str]]) -> tuple[re.Pattern, list[str]]:
+    """Saml alle reglerne til ét udtryk. Returner udtrykket og gruppernes tags.
+
+    Hver regel er et valgfrit lookahead fra starten af titlen, så ét kald
+    til match finder alle reglerne der passer.
+    """
+    patterns = list(rules)
+    for tag, tag_titles in titles.items():
+        exact = "|".join(re.escape(title) for title in tag_titles)
+        patterns.append((tag, f"^(?:{exact})$"))
+    parts = []
+    group_tags = []
+    for i, (tag, pattern) in enumerate(patterns):
+        parts.append(f"(?=(?:.*?(?P<r{i}>{pattern}))?)")
+        group_tags.append(tag)
+    return (re.compile("".join(parts), re.DOTALL), group_tags)
+
+
+(re_rules, rule_tags) = compile_rules(RULES, TITLES)
+
+
+def tags_for(title: str) -> list[str]:
+    """Alle tags som reglerne giver titlen (sorteret)."""
+    match = re_rules.match(normalize(title))
+    return sorted({rule_tags[int(name[1:])]
+                   for (name, group) in match.groupdict().items()
+                   if group is not None})
+
+
+def tag(concert: Concert):
+    """Tilføj reglernes tags til koncerten (scraperens egne tags beholdes)."""
+    concert.tags = sorted(set(concert.tags) | set(tags_for(concert.title)))
+
+
+def is_blacklisted(concert: Concert) -> bool:
+    return not BLACKLIST.isdisjoint(concert.tags)
@@ -0,0 +1,284 @@
+import concurrent.futures
+import hashlib
+import io
+import json
+import multiprocessing
+import re
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from urllib.parse import quote
+
+from PIL import Image, features
+
+import fetch
+import metrics
+from concert import Concert
+
+
+# Miniaturer laves i to trin: billederne hentes i tråde, og afkodning,
+# skalering og kodning sker i en proces-pulje, da det er CPU-tungt og
+# holder GIL'en. Hvert billede gemmes i flere bredder som både AVIF og
+# WebP, så siden kan bruge srcset og telefoner henter mindre billeder.
+#
+# Miniaturerne gemmes efter indhold: filnavnet er en hash af kildebilledet.
+# Manifestet husker hvilken fil hver kilde-URL og hver koncert bruger, så
+# det samme billede kun hentes og kodes én gang, også hvis koncerten får ny
+# titel eller dato.
+#
+# Manifestet husker også hvornår hver miniature sidst blev brugt, så
+# gamle miniaturer kan slettes igen (collect_garbage).
+
+
+THUMBNAIL_SIZE = 768
+# Bredderne der laves af hvert billede. Den største er hovedbilledet.
+VARIANT_WIDTHS = (384, 576, THUMBNAIL_SIZE)
+# Formaterne og deres indstillinger. AVIF kræver en Pillow med libavif.
+FORMATS = {"webp": dict(lossless=False, quality=80)}
+if features.check("avif"):
+    FORMATS = {"avif": dict(quality=50)} | FORMATS
+# Hvor brede billederne vises på siden (se .concert i templates/index.html)
+THUMBNAIL_SIZES = "(min-width: 1152px) 370px, (min-width: 780px) 50vw, 100vw"
+IMAGES_DIR = Path("images")
+MANIFEST_PATH = IMAGES_DIR / "manifest.json"
+# Miniaturer der ikke er brugt i så mange dage slettes
+RETENTION_DAYS = 30
+# Hvor ofte datoen for sidste brug opdateres
+USED_RESOLUTION_DAYS = 7
+# Højeste samlede størrelse af miniaturerne i bytes
+SIZE_BUDGET = 64 * 1024 * 1024
+
+re_legacy_date = re.compile(r"\d{4}-\d{2}-\d{2}")
+re_variant = re.compile(r"([0-9a-f]{16})-(\d+)\.(\w+)")
+
+
+def load_manifest() -> dict[str, dict[str, str]]:
+    """Indlæs manifestet over miniaturerne."""
+    manifest = {"sources": {}, "hashes": {}, "concerts": {}, "used": {}}
+    try:
+        with open(MANIFEST_PATH, "r") as file:
+            manifest |= json.load(file)
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def save_manifest(manifest: dict[str, dict[str, str]]):
+    """Gem manifestet (sorteret så ændringerne er små i git)."""
+    content = json.dumps(manifest, indent=1, sort_keys=True, ensure_ascii=False)
+    try:
+        if MANIFEST_PATH.read_text() == content:
+            return
+    except FileNotFoundError:
+        pass
+    MANIFEST_PATH.write_text(content)
+
+
+def store_path(digest: str) -> Path:
+    """Stien til hovedbilledet af kildebilledet med den givne hash."""
+    return variant_path(IMAGES_DIR / digest[:16], THUMBNAIL_SIZE, "webp")
+
+
+def variant_path(path: Path, width: int, fmt: str) -> Path:
+    """Stien til en anden bredde/format af miniaturen ved stien."""
+    stem = path.stem.split("-")[0]
+    return path.with_name(f"{stem}-{width}.{fmt}")
+
+
+def main_name(name: str) -> str:
+    """Filnavnet på hovedbilledet som filen er en variant af."""
+    variant = re_variant.fullmatch(name)
+    if variant is None:
+        return name
+    return store_path(variant[1]).name
+
+
+def srcset(img_url: str, fmt: str) -> str:
+    """srcset med alle bredder af miniaturen i formatet, ellers ""."""
+    path = Path(img_url)
+    if path.parent != IMAGES_DIR or not re_variant.fullmatch(path.name):
+        return ""
+    candidates = []
+    for width in VARIANT_WIDTHS:
+        variant = variant_path(path, width, fmt)
+        if variant.exists():
+            candidates.append(f"{quote(str(variant))} {width}w")
+    return ", ".join(candidates)
+
+
+def legacy_thumbnail_path(concert: Concert) -> Path:
+    """Stien til koncertens miniature fra før manifestet (navngivet efter koncerten)."""
+    name = f"{concert.date.date()} - {concert.venue} - {concert.title}.webp"
+    # Fjern alle tegn der ikke må være i filnavne
+    escaped_name = name.translate(str.maketrans("", "", "<>:\"/\\|?*"))
+    return IMAGES_DIR / escaped_name
+
+
+def download(url: str) -> tuple[bytes, str]:
+    """Hent billedets rå bytes fra URL og deres hash."""
+    data = fetch.get(url, cache=False).content
+    return (data, hashlib.sha256(data).hexdigest())
+
+
+def encode_thumbnail(data: bytes, path: str) -> float:
+    """Lav optimerede miniaturer ud fra billedets bytes.
+
+    Alle bredder og formater gemmes ved siden af hovedbilledet ved stien.
+    Køres i en anden proces, så CPU-tiden returneres til målingerne.
+    """
+    start = time.process_time()
+    img = Image.open(io.BytesIO(data))
+    if img.width < THUMBNAIL_SIZE:
+        print(f"WARN: Image < {THUMBNAIL_SIZE}px, {path}")
+    if img.width < img.height:
+        print(f"WARN: Portrait image, {path}")
+    # JPEG kan skaleres billigt ned allerede under afkodningen
+    img.draft(None, (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    # Fra største til mindste så hver skalering starter fra et mindre billede
+    for width in sorted(VARIANT_WIDTHS, reverse=True):
+        img.thumbnail((width, width))
+        for fmt, options in FORMATS.items():
+            img.save(variant_path(Path(path), width, fmt), fmt.upper(), **options)
+    return time.process_time() - start
+
+
+@metrics.stage("make_thumbnails")
+def make_thumbnails(concerts: list[Concert]):
+    """Lav miniature til koncerterne og opdater billede-URL'erne."""
+    print("Laver thumbnails...")
+    manifest = load_manifest()
+    sources = manifest["sources"]
+    # Koncerter med samme kildebillede deler miniature
+    todo: dict[str, list[Concert]] = {}
+    for concert in concerts:
+        source = concert.img_url
+        if source not in sources:
+            # Genbrug miniaturer fra før manifestet
+            legacy = legacy_thumbnail_path(concert)
+            if legacy.exists():
+                sources[source] = legacy.name
+        if source in sources and (IMAGES_DIR / sources[source]).exists():
+            set_thumbnail(manifest, concert, sources[source])
+        else:
+            todo.setdefault(source, []).append(concert)
+    reused = len(concerts) - sum(len(cs) for cs in todo.values())
+    # Kilde-URL -> hash af billedet
+    digests: dict[str, str] = {}
+    # Hash -> (filnavn, kodning). Samme billede fra flere URL'er kodes én gang.
+    encoded: dict[str, tuple[str, concurrent.futures.Future | None]] = {}
+    with (concurrent.futures.ThreadPoolExecutor() as downloads,
+          # spawn: fork er ikke sikkert mens hentetrådene og sessionen kører
+          concurrent.futures.ProcessPoolExecutor(
+              mp_context=multiprocessing.get_context("spawn")) as encoders):
+        download_counted = metrics.propagate(download)
+        download_to_source = {downloads.submit(download_counted, source): source
+                              for source in todo}
+        # Kod billederne så snart de er hentet
+        for future in concurrent.futures.as_completed(download_to_source):
+            source = download_to_source[future]
+            try:
+                (data, digest) = future.result()
+            except Exception as e:
+                print(f"Fejl ved hentning af billede: {source}")
+                print("   ", e)
+                continue
+            digests[source] = digest
+            if digest in encoded:
+                continue
+            known = manifest["hashes"].get(digest)
+            if known and (IMAGES_DIR / known).exists():
+                encoded[digest] = (known, None)
+            else:
+                path = store_path(digest)
+                encoded[digest] = (path.name, encoders.submit(
+                    encode_thumbnail, data, str(path)))
+        for source, digest in digests.items():
+            (name, future) = encoded[digest]
+            try:
+                if future is not None:
+                    future.result()
+            except Exception as e:
+                print(f"Fejl ved miniature til billede: {source}")
+                print("   ", e)
+                continue
+            manifest["hashes"][digest] = name
+            sources[source] = name
+            for concert in todo[source]:
+                set_thumbnail(manifest, concert, name)
+    save_manifest(manifest)
+    # Kun kodninger der lykkedes
+    new = [future for (_, future) in encoded.values()
+           if future is not None and not future.exception()]
+    metrics.add("reused", reused)
+    metrics.add("encoded", len(new))
+    # Kodningen sker i andre processer og tælles derfor ikke med i cpu_s
+    metrics.add("encode_cpu_s", sum(f.result() for f in new))
+    print(f"Færdig med thumbnails! ({reused} genbrugt, {len(new)} nye)")
+
+
+def set_thumbnail(manifest: dict[str, dict[str, str]], concert: Concert,
+                  name: str):
+    """Peg koncerten på miniaturen med det givne filnavn."""
+    manifest["concerts"][concert.url] = name
+    # Datoen opdateres kun en gang om ugen så manifestet ikke ændres hver dag
+    last_week = (date.today() - timedelta(days=USED_RESOLUTION_DAYS)).isoformat()
+    if manifest["used"].get(name, "") <= last_week:
+        manifest["used"][name] = date.today().isoformat()
+    concert.img_url = str(IMAGES_DIR / name)
+
+
+def collect_garbage(concerts: list[Concert], retention_days: int = RETENTION_DAYS,
+                    size_budget: int = SIZE_BUDGET):
+    """Slet miniaturer som ingen nuværende eller nylige koncerter bruger.
+
+    Miniaturer til de givne koncerter slettes aldrig. Andre beholdes i
+    retention_days dage efter sidste brug, men slettes ældste først hvis
+    mappen fylder mere end size_budget bytes.
+    """
+    print("Rydder op i miniaturer...")
+    manifest = load_manifest()
+    used = manifest["used"]
+    in_use = {Path(c.img_url).name for c in concerts
+              if Path(c.img_url).parent == IMAGES_DIR}
+    oldest_kept = (date.today() - timedelta(days=retention_days)).isoformat()
+    # Hovedbillede -> størrelsen af det og alle dets varianter
+    files: dict[str, int] = {}
+    variants: dict[str, list[Path]] = {}
+    for path in IMAGES_DIR.iterdir():
+        if path.suffix[1:] not in ("webp", "avif"):
+            continue
+        name = main_name(path.name)
+        files[name] = files.get(name, 0) + path.stat().st_size
+        variants.setdefault(name, []).append(path)
+
+    def last_used(name: str) -> str:
+        # Filer fra før manifestet starter med koncertens dato
+        legacy_date = re_legacy_date.match(name)
+        return used.get(name) or (legacy_date[0] if legacy_date else "")
+
+    # Filer der ikke er i brug; dem der er brugt for længst tid siden først.
+    unused = sorted((name for name in files if name not in in_use),
+                    key=last_used)
+    total = sum(files.values())
+    deleted = set()
+    for name in unused:
+        if last_used(name) >= oldest_kept and total <= size_budget:
+            continue
+        for path in variants[name]:
+            path.unlink()
+        total -= files[name]
+        deleted.add(name)
+    reclaimed = sum(files[name] for name in deleted)
+    # Fjern alle henvisninger til de slettede filer
+    for key in ("sources", "hashes", "concerts"):
+        manifest[key] = {k: v for (k, v) in manifest[key].items()
+                         if v not in deleted and v in files}
+    manifest["used"] = {k: v for (k, v) in used.items()
+                        if k not in deleted and k in files}
+    save_manifest(manifest)
+    if total > size_budget:
+        print(f"WARN: Miniaturer i brug fylder {total / 2**20:.1f} MiB, "
+              f"mere end budgettet på {size_budget / 2**20:.1f} MiB")
+    print(f"Færdig! Slettede {len(deleted)} miniaturer "
+          f"({reclaimed / 2**20:.1f} MiB), {total / 2**20:.1f} MiB tilbage")